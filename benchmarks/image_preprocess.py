@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""Per-frame cost of image feature extraction.
+
+Compares get_features_from_image_with_studio_mode (packed uint32 temporaries
+and a Python list) with ImageFeatureExtractor (reused float32 buffers) for
+every studio resize mode, reporting time and allocated bytes per frame.
+
+Usage: python benchmarks/image_preprocess.py [width]x[height] [frames]
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from edge_impulse_linux.image import ImageFeatureExtractor, get_features_from_image_with_studio_mode  # noqa: E402
+
+
+def measure(fn, frames):
+    fn()
+    start = time.perf_counter()
+    for _ in range(frames):
+        fn()
+    elapsed = (time.perf_counter() - start) / frames * 1000
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main(argv):
+    width, height = (int(v) for v in (argv[0] if len(argv) > 0 else '1920x1080').split('x'))
+    frames = int(argv[1]) if len(argv) > 1 else 100
+
+    img = np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+    out = np.empty((96 * 96,), dtype=np.float32)
+
+    print('input %dx%d, output 96x96' % (width, height))
+    print('%-14s %-6s %12s %12s %14s %14s' % ('mode', 'gray', 'list (ms)', 'engine (ms)', 'list (bytes)', 'engine (bytes)'))
+    for mode in ['fit-shortest', 'fit-longest', 'squash']:
+        for grayscale in [False, True]:
+            extractor = ImageFeatureExtractor(mode, 96, 96, grayscale)
+            t_list, m_list = measure(lambda: get_features_from_image_with_studio_mode(img, mode, 96, 96, grayscale), frames)
+            t_engine, m_engine = measure(lambda: extractor.extract(img, out=out), frames)
+            print('%-14s %-6s %12.3f %12.3f %14d %14d' % (mode, grayscale, t_list, t_engine, m_list, m_engine))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""Throughput of RunnerPool with an increasing number of workers.
+
+Every stub runner spins on the CPU for the configured inference time, so the
+aggregate throughput is bounded by the number of available cores.
+
+Usage: python benchmarks/pool.py [inference_ms] [samples]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from edge_impulse_linux.pool import RunnerPool  # noqa: E402
+
+STUB_RUNNER = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'stub_runner.py')
+
+
+def main(argv):
+    inference_ms = argv[0] if len(argv) > 0 else '20'
+    samples = int(argv[1]) if len(argv) > 1 else 200
+
+    os.environ['EI_STUB_LATENCY_MS'] = inference_ms
+    os.environ['EI_STUB_BUSY'] = '1'
+    os.environ['EI_STUB_FEATURES'] = '16'
+    features = [0.0] * 16
+
+    cores = os.cpu_count() or 1
+    counts = sorted(set([1, 2, 4, 8, 16, cores]))
+    baseline = None
+    print('%8s %14s %10s' % ('workers', 'inferences/s', 'scaling'))
+    for workers in [c for c in counts if c <= cores]:
+        with RunnerPool(STUB_RUNNER, workers=workers, allow_shm=False) as pool:
+            pool.init()
+            start = time.perf_counter()
+            for _ in pool.classify_many(features for _ in range(samples)):
+                pass
+            throughput = samples / (time.perf_counter() - start)
+        baseline = baseline or throughput
+        print('%8d %14.1f %9.2fx' % (workers, throughput, throughput / baseline))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
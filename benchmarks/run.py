@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""Benchmark harness with machine-readable output, for catching performance regressions.
+
+Runs every suite against the stub runner (no real model needed) and writes the
+results as JSON: one entry per measurement with a name, a value and a unit.
+Units ending in '_ms' or '_us' are lower-is-better, '_per_s' and 'x_realtime'
+are higher-is-better.
+
+Suites:
+    ipc     send_msg round-trip latency (p50/p99) for small and large responses
+    shm     classify throughput over JSON, binary requests and shared memory,
+            and with freeform outputs returned as lists or views
+    image   feature extraction per studio resize mode and input resolution,
+            and the motion gate
+    image_input  classify_image with float32 features vs uint8 / int8 pixels
+    audio   ring buffer windowing, file windowing and classify_file
+
+Usage:
+    python benchmarks/run.py [--suite ipc shm ...] [--output results.json]
+                             [--compare baseline.json] [--tolerance 0.2] [--quick]
+
+With --compare, every measurement that is more than --tolerance (relative)
+worse than in the baseline is reported and the exit code is 1.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from edge_impulse_linux.runner import ImpulseRunner  # noqa: E402
+
+STUB_RUNNER = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'stub_runner.py')
+STUB_ENV = ('EI_STUB_LATENCY_MS', 'EI_STUB_BUSY', 'EI_STUB_BOXES', 'EI_STUB_FEATURES',
+            'EI_STUB_FREQUENCY', 'EI_STUB_SHM', 'EI_STUB_FREEFORM', 'EI_STUB_BINARY',
+            'EI_STUB_INPUT_TYPE')
+LOWER_IS_BETTER = ('_ms', '_us')
+
+
+def stub_env(**settings):
+    # the stub is configured through the environment, reset everything between runs
+    for key in STUB_ENV:
+        os.environ.pop(key, None)
+    for key, value in settings.items():
+        os.environ['EI_STUB_' + key.upper()] = str(value)
+
+
+def result(name, value, unit, **extra):
+    entry = { 'name': name, 'value': round(float(value), 6), 'unit': unit }
+    entry.update(extra)
+    return entry
+
+
+def per_iteration(fn, iterations, warmup=5):
+    for _ in range(warmup):
+        fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations
+
+
+def suite_ipc(iterations):
+    results = []
+    for boxes in [0, 100, 1000]:
+        stub_env(features=16, boxes=boxes)
+        runner = ImpulseRunner(STUB_RUNNER, allow_shm=False)
+        try:
+            runner.init()
+            features = [0.0] * 16
+            per_iteration(lambda: runner.classify(features), 10, warmup=0)
+            runner.metrics().reset()
+            for _ in range(iterations):
+                runner.classify(features)
+            roundtrip = runner.metrics().summary()['roundtrip']
+        finally:
+            runner.stop()
+        results.append(result('ipc.roundtrip.boxes%d.p50' % boxes, roundtrip['p50_ms'], 'p50_ms'))
+        results.append(result('ipc.roundtrip.boxes%d.p99' % boxes, roundtrip['p99_ms'], 'p99_ms'))
+    return results
+
+
+def suite_shm(iterations):
+    results = []
+    features = np.random.rand(9216).astype(np.float32)
+    for transport in ['json', 'binary', 'shm']:
+        stub_env(features=9216, shm=int(transport == 'shm'), binary=int(transport == 'binary'))
+        runner = ImpulseRunner(STUB_RUNNER, allow_shm=transport == 'shm')
+        try:
+            runner.init()
+            seconds = per_iteration(lambda: runner.classify_array(features), iterations)
+            serialize = runner.metrics().summary()['serialize']['p50_ms']
+        finally:
+            runner.stop()
+        results.append(result('shm.classify.%s' % transport, 1 / seconds, 'inferences_per_s'))
+        results.append(result('shm.classify.%s.serialize' % transport, serialize, 'p50_ms'))
+
+    for shm in [False, True]:
+        for mode in (['list', 'view'] if shm else ['list']):
+            stub_env(features=16, shm=int(shm), freeform='100000')
+            runner = ImpulseRunner(STUB_RUNNER, allow_shm=shm, freeform_output=mode)
+            try:
+                runner.init()
+                seconds = per_iteration(lambda: runner.classify_array(features[:16]), iterations)
+            finally:
+                runner.stop()
+            name = 'shm.freeform100k.%s' % (mode if shm else 'json')
+            results.append(result(name, 1 / seconds, 'inferences_per_s'))
+    return results
+
+
+def suite_image(iterations):
+    from edge_impulse_linux.image import ImageFeatureExtractor, MotionGate
+
+    results = []
+    for width, height in [(640, 480), (1280, 720), (1920, 1080)]:
+        img = np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+        out = np.empty((96 * 96,), dtype=np.float32)
+        for mode in ['fit-shortest', 'fit-longest', 'squash']:
+            for grayscale in [False, True]:
+                extractor = ImageFeatureExtractor(mode, 96, 96, grayscale)
+                seconds = per_iteration(lambda: extractor.extract(img, out=out), iterations)
+                name = 'image.%s.%dx%d.%s' % (mode, width, height, 'gray' if grayscale else 'rgb')
+                results.append(result(name, seconds * 1000, 'frame_ms'))
+
+        gate = MotionGate(0.02)
+        seconds = per_iteration(lambda: gate.is_static(img), iterations)
+        results.append(result('image.motion_gate.%dx%d' % (width, height), seconds * 1000, 'frame_ms'))
+    return results
+
+
+def suite_image_input(iterations):
+    from edge_impulse_linux.image import ImageImpulseRunner
+
+    results = []
+    img = np.random.randint(0, 256, (480, 640, 3), dtype=np.uint8)
+    for input_type in ['float32', 'uint8', 'int8']:
+        for transport in ['binary', 'shm']:
+            stub_env(features=9216, input_type=input_type, binary=1, shm=int(transport == 'shm'))
+            runner = ImageImpulseRunner(STUB_RUNNER, allow_shm=transport == 'shm')
+            try:
+                runner.init()
+                seconds = per_iteration(lambda: runner.classify_image(img), iterations)
+            finally:
+                runner.stop()
+            results.append(result('image.classify.%s.%s' % (input_type, transport), seconds * 1000, 'frame_ms'))
+    return results
+
+
+def write_wav(path, seconds, rate=44100, channels=2):
+    samples = (np.sin(np.arange(int(seconds * rate)) / 10) * 10000).astype(np.int16)
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(np.repeat(samples, channels).tobytes())
+
+
+def suite_audio(iterations):
+    from edge_impulse_linux.audio import AudioFileSource, AudioImpulseRunner, RingBuffer, CHUNK_SIZE, OVERLAP
+
+    results = []
+    window_size = 16000
+    hop_size = int(window_size * OVERLAP)
+
+    # microphone path: chunks go into the ring, every hop a window is peeked in place
+    ring = RingBuffer(window_size + hop_size + CHUNK_SIZE * 8)
+    chunk = np.zeros((CHUNK_SIZE,), dtype=np.int16)
+
+    def next_window():
+        while len(ring) < window_size:
+            ring.write(chunk)
+        ring.peek(window_size)
+        ring.consume(hop_size)
+
+    seconds = per_iteration(next_window, iterations * 10)
+    results.append(result('audio.ring.window', seconds * 1e6, 'window_us'))
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        path = os.path.join(tempdir, 'audio.wav')
+        duration = 30
+        write_wav(path, duration)
+
+        source = AudioFileSource(path)
+        start = time.perf_counter()
+        for _ in source.resampled(16000):
+            pass
+        results.append(result('audio.file.resample', duration / (time.perf_counter() - start), 'x_realtime'))
+
+        stub_env(features=window_size, frequency=16000)
+        runner = AudioImpulseRunner(STUB_RUNNER, allow_shm=False)
+        try:
+            runner.init()
+            start = time.perf_counter()
+            runner.classify_file(path)
+            elapsed = time.perf_counter() - start
+        finally:
+            runner.stop()
+        results.append(result('audio.classify_file', duration / elapsed, 'x_realtime'))
+    return results
+
+
+SUITES = {
+    'ipc': suite_ipc,
+    'shm': suite_shm,
+    'image': suite_image,
+    'image_input': suite_image_input,
+    'audio': suite_audio,
+}
+
+
+def metadata():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.realpath(__file__))).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    previous = { r['name']: r for r in baseline['results'] }
+    regressions = []
+    for r in results:
+        before = previous.get(r['name'])
+        if before is None or before['value'] <= 0 or r['value'] <= 0:
+            continue
+        if r['unit'].endswith(LOWER_IS_BETTER):
+            change = r['value'] / before['value'] - 1
+        else:
+            change = before['value'] / r['value'] - 1
+        if change > tolerance:
+            regressions.append({ 'name': r['name'], 'unit': r['unit'], 'baseline': before['value'],
+                                 'value': r['value'], 'worse_by': round(change, 3) })
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Run the SDK benchmarks against the stub runner')
+    parser.add_argument('--suite', nargs='+', choices=list(SUITES), default=list(SUITES), help='Suites to run')
+    parser.add_argument('--output', help='Write the results to this file instead of stdout')
+    parser.add_argument('--compare', help='Baseline results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Relative slowdown counted as a regression')
+    parser.add_argument('--quick', action='store_true', help='Fewer iterations, for smoke tests')
+    args = parser.parse_args(argv)
+
+    iterations = 20 if args.quick else 200
+    report = { 'meta': metadata(), 'results': [], 'skipped': {} }
+    for name in args.suite:
+        try:
+            report['results'].extend(SUITES[name](iterations))
+        except ImportError as e:
+            # e.g. the audio suite without PyAudio
+            report['skipped'][name] = str(e)
+    stub_env()
+
+    status = 0
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            report['regressions'] = compare(report['results'], json.load(f), args.tolerance)
+        status = 1 if report['regressions'] else 0
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Micro-benchmark for ImpulseRunner.send_msg response parsing.
+
+Runs the stub runner with responses of increasing size (number of bounding
+boxes) and compares the framed reader against the previous implementation
+(1024-byte recv calls, bytes concatenation and a per-character brace scan).
+
+Usage: python benchmarks/send_msg.py [iterations]
+"""
+
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from edge_impulse_linux.runner import ImpulseRunner  # noqa: E402
+
+STUB_RUNNER = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'stub_runner.py')
+
+
+def legacy_send_msg(runner, msg):
+    runner._ix = runner._ix + 1
+    msg['id'] = runner._ix
+    runner._client.send(json.dumps(msg).encode('utf-8'))
+
+    data = b''
+    while True:
+        chunk = runner._client.recv(1024)
+        if chunk[-1] == 0:
+            data = data + chunk[:-1]
+            break
+        data = data + chunk
+
+    braces_open = 0
+    braces_closed = 0
+    line = ''
+    resp = None
+    for c in data.decode('utf-8'):
+        if c == '{':
+            line = line + c
+            braces_open = braces_open + 1
+        elif c == '}':
+            line = line + c
+            braces_closed = braces_closed + 1
+            if braces_closed == braces_open:
+                resp = json.loads(line)
+        elif braces_open > 0:
+            line = line + c
+        if resp is not None:
+            break
+    return resp
+
+
+def bench(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main(argv):
+    iterations = int(argv[0]) if len(argv) > 0 else 200
+
+    os.environ['EI_STUB_FEATURES'] = '1'
+    print('%8s %10s %12s %12s %8s' % ('boxes', 'bytes', 'legacy (ms)', 'framed (ms)', 'speedup'))
+    for boxes in [0, 10, 100, 1000, 5000]:
+        os.environ['EI_STUB_BOXES'] = str(boxes)
+        runner = ImpulseRunner(STUB_RUNNER, allow_shm=False)
+        try:
+            runner.init()
+            size = len(json.dumps(runner.classify([0])))
+            legacy = bench(lambda: legacy_send_msg(runner, { 'classify': [0] }), iterations)
+            framed = bench(lambda: runner.send_msg({ 'classify': [0] }), iterations)
+        finally:
+            runner.stop()
+        print('%8d %10d %12.3f %12.3f %7.1fx' % (boxes, size, legacy, framed, legacy / framed))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
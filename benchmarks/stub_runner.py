@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""Stand-in for an .eim model file, used by the benchmarks in this directory.
+
+Speaks the same Unix socket protocol as a real runner: JSON requests from the
+client, JSON responses terminated by \\x00. It is configured through environment
+variables (the SDK only passes the socket path on the command line):
+
+    EI_STUB_LATENCY_MS   simulated inference time per classify (default 0)
+    EI_STUB_BUSY         if 1, spend the inference time spinning on the CPU
+                         instead of sleeping, like a real model (default 0)
+    EI_STUB_BOXES        if > 0, reply with this many bounding boxes instead
+                         of a classification result (default 0)
+    EI_STUB_FEATURES     number of input features (default 9216, 96x96)
+    EI_STUB_FREQUENCY    if > 0, pretend to be an audio model sampling at this
+                         frequency (default 0)
+    EI_STUB_SHM          if 1, advertise a features_shm input buffer and accept
+                         classify_shm requests (default 0)
+    EI_STUB_FREEFORM     comma separated element counts of float32 freeform
+                         outputs, e.g. 1000,4 (default none). With EI_STUB_SHM
+                         they are returned through freeform_output_shm, otherwise
+                         as lists in the JSON response
+    EI_STUB_BINARY       if 1, accept binary classify requests when the client
+                         offers them in hello (default 0, like current runners)
+    EI_STUB_INPUT_TYPE   native input type, float32 (packed RGB features) or
+                         uint8 / int8 (raw HWC pixels, 3 per feature); used for
+                         features_shm and listed first in the binary types
+                         (default float32)
+
+Usage: stub_runner.py <socket_path>
+"""
+
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+import time
+from multiprocessing import shared_memory
+
+LATENCY_MS = float(os.environ.get('EI_STUB_LATENCY_MS', '0'))
+BUSY = os.environ.get('EI_STUB_BUSY', '0') == '1'
+BOXES = int(os.environ.get('EI_STUB_BOXES', '0'))
+FEATURES = int(os.environ.get('EI_STUB_FEATURES', '9216'))
+FREQUENCY = int(os.environ.get('EI_STUB_FREQUENCY', '0'))
+SHM = os.environ.get('EI_STUB_SHM', '0') == '1'
+FREEFORM = [int(n) for n in os.environ.get('EI_STUB_FREEFORM', '').split(',') if n.strip()]
+BINARY = os.environ.get('EI_STUB_BINARY', '0') == '1'
+INPUT_TYPE = os.environ.get('EI_STUB_INPUT_TYPE', 'float32')
+LABELS = ['background', 'object']
+
+# binary requests: magic, little-endian uint32 header length, JSON header, raw payload
+BINARY_MAGIC = b'EIB1'
+BINARY_ITEMSIZE = { 'float32': 4, 'int8': 1, 'uint8': 1 }
+
+# changed by set_threshold, reported in hello
+thresholds = [{ 'id': 3, 'min_score': 0.5, 'type': 'object_detection' }]
+
+# created in main() when EI_STUB_SHM is set
+features_shm = None
+freeform_shm = []
+
+
+def hello_response(msg):
+    resp = {
+        'project': { 'id': 1, 'owner': 'Edge Impulse', 'name': 'Stub runner', 'deploy_version': 1 },
+        'model_parameters': {
+            'axis_count': 1,
+            'frequency': FREQUENCY,
+            'has_anomaly': 0,
+            'image_channel_count': 3,
+            'image_input_frames': 1,
+            'image_input_height': 96,
+            'image_input_width': 96,
+            'image_resize_mode': 'fit-shortest',
+            'input_features_count': FEATURES,
+            'interval_ms': 1,
+            'label_count': len(LABELS),
+            'labels': LABELS,
+            'model_type': 'object_detection' if BOXES > 0 else 'classification',
+            'sensor': 1 if FREQUENCY > 0 else 3,
+            'slice_size': FEATURES,
+            'thresholds': [dict(t) for t in thresholds],
+            'use_continuous_mode': False,
+        },
+    }
+    if BINARY and msg.get('binary_protocol') == 1:
+        types = [INPUT_TYPE] + [t for t in BINARY_ITEMSIZE if t != INPUT_TYPE]
+        resp['binary_protocol'] = { 'version': 1, 'types': types }
+    if features_shm is not None:
+        resp['features_shm'] = { 'name': '/' + features_shm.name, 'type': INPUT_TYPE, 'elements': elements(INPUT_TYPE) }
+    if freeform_shm:
+        resp['freeform_output_shm'] = [
+            { 'index': ix, 'name': '/' + shm.name, 'type': 'float32', 'elements': FREEFORM[ix] }
+            for ix, shm in enumerate(freeform_shm)
+        ]
+    return resp
+
+
+def classify_response():
+    if LATENCY_MS > 0 and BUSY:
+        deadline = time.perf_counter() + LATENCY_MS / 1000
+        while time.perf_counter() < deadline:
+            pass
+    elif LATENCY_MS > 0:
+        time.sleep(LATENCY_MS / 1000)
+
+    if FREEFORM and freeform_shm:
+        # the runner writes its outputs into shared memory and only says so in the response
+        for shm in freeform_shm:
+            shm.buf[:4] = b'\x00\x00\x80\x3f'
+        result = { 'freeform': 'shm' }
+    elif FREEFORM:
+        result = { 'freeform': [[0.0] * n for n in FREEFORM] }
+    elif BOXES > 0:
+        result = { 'bounding_boxes': [
+            { 'label': LABELS[i % len(LABELS)], 'value': 0.9, 'x': i % 96, 'y': i % 96, 'width': 8, 'height': 8 }
+            for i in range(BOXES)
+        ] }
+    else:
+        result = { 'classification': { label: 1 / len(LABELS) for label in LABELS } }
+
+    return {
+        'result': result,
+        'timing': { 'dsp': 0, 'classification': int(LATENCY_MS), 'anomaly': 0 },
+    }
+
+
+def elements(input_type):
+    # quantized input is the raw RGB pixels, float32 input one packed value per pixel
+    return FEATURES if input_type == 'float32' else FEATURES * 3
+
+
+def handle(msg, payload):
+    if 'hello' in msg:
+        return hello_response(msg)
+    if 'classify' in msg:
+        if len(msg['classify']) != FEATURES:
+            raise Exception('Expected %d features, got %d' % (FEATURES, len(msg['classify'])))
+        return classify_response()
+    if 'classify_shm' in msg:
+        if features_shm is None:
+            raise Exception('Shared memory is not enabled')
+        if msg['classify_shm']['elements'] != elements(INPUT_TYPE):
+            raise Exception('Expected %d features, got %d' % (elements(INPUT_TYPE), msg['classify_shm']['elements']))
+        return classify_response()
+    if 'classify_binary' in msg:
+        expected = elements(msg['classify_binary']['type'])
+        if msg['classify_binary']['elements'] != expected:
+            raise Exception('Expected %d features, got %d' % (expected, msg['classify_binary']['elements']))
+        return classify_response()
+    if 'set_threshold' in msg:
+        threshold = next((t for t in thresholds if t['id'] == msg['set_threshold'].get('id')), None)
+        if threshold is None:
+            raise Exception('Unknown threshold id')
+        threshold.update(msg['set_threshold'])
+        return {}
+    raise Exception('Unknown message')
+
+
+def next_message(pending, decoder):
+    """Returns (msg, payload, length) for the first complete request in pending, or None."""
+    if pending[:4] == BINARY_MAGIC:
+        if len(pending) < 8:
+            return None
+        header_end = 8 + struct.unpack_from('<I', pending, 4)[0]
+        if len(pending) < header_end:
+            return None
+        msg = json.loads(bytes(pending[8:header_end]))
+        header = msg['classify_binary']
+        end = header_end + header['elements'] * BINARY_ITEMSIZE[header['type']]
+        if len(pending) < end:
+            return None
+        return msg, bytes(pending[header_end:end]), end
+
+    try:
+        # requests are ASCII JSON, latin-1 keeps string offsets equal to byte offsets
+        msg, end = decoder.raw_decode(pending.decode('latin-1'))
+    except ValueError:
+        return None
+    return msg, None, end
+
+
+def serve(conn):
+    decoder = json.JSONDecoder()
+    pending = bytearray()
+    while True:
+        chunk = conn.recv(65536)
+        if not chunk:
+            return
+        pending += chunk
+        while pending:
+            pending = pending.lstrip()
+            parsed = next_message(pending, decoder)
+            if parsed is None:
+                break
+            msg, payload, end = parsed
+            del pending[:end]
+            try:
+                resp = handle(msg, payload)
+                resp['success'] = True
+            except Exception as e:
+                resp = { 'success': False, 'error': str(e) }
+            resp['id'] = msg.get('id')
+            conn.sendall(json.dumps(resp).encode('utf-8') + b'\x00')
+
+
+def main(argv):
+    if len(argv) != 1:
+        print('Usage: stub_runner.py <socket_path>')
+        sys.exit(2)
+
+    global features_shm
+    # stop() escalates to SIGTERM, unwind normally so the shared memory is unlinked
+    signal.signal(signal.SIGTERM, lambda sig, frame: sys.exit(0))
+    if SHM:
+        features_shm = shared_memory.SharedMemory(create=True, size=elements(INPUT_TYPE) * BINARY_ITEMSIZE[INPUT_TYPE])
+        for n in FREEFORM:
+            freeform_shm.append(shared_memory.SharedMemory(create=True, size=max(n, 1) * 4))
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(argv[0])
+    server.listen(1)
+    try:
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                serve(conn)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        for shm in ([features_shm] if features_shm is not None else []) + freeform_shm:
+            shm.close()
+            shm.unlink()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
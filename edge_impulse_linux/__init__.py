@@ -1,3 +1,16 @@
-from edge_impulse_linux import runner
-from edge_impulse_linux import audio
-from edge_impulse_linux import image
+import importlib
+
+# submodules are imported on first access (PEP 562), so using the runner for
+# custom sensor data does not load OpenCV or PyAudio
+_SUBMODULES = ('runner', 'audio', 'image', 'async_runner', 'pool', 'broker', 'metrics', 'pipeline', 'streams',
+               'cache')
+
+__all__ = list(_SUBMODULES)
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module ' + repr(__name__) + ' has no attribute ' + repr(name))
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_SUBMODULES))
@@ -0,0 +1,296 @@
+import asyncio
+import collections
+import json
+import time
+import numpy as np
+from edge_impulse_linux.cache import ResultCache
+from edge_impulse_linux.runner import ImpulseRunner, STARTUP_TIMEOUT, BINARY_PROTOCOL_VERSION, _check_resp, _encode_msg, \
+    _terminate_process
+
+# asyncio.StreamReader refuses frames larger than its limit (64 KiB by default),
+# object detection and freeform responses can easily exceed that
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+class AsyncImpulseRunner(ImpulseRunner):
+    """ImpulseRunner for asyncio applications.
+
+    Uses the same hello / classify / set_threshold protocol, but requests are
+    written without waiting for earlier responses; a background task routes each
+    response to the request with the same id. At most ``max_in_flight`` requests
+    are outstanding at any time.
+
+    When the runner uses shared memory, only one classify request can own the
+    shared memory buffers, so classify calls are serialized. Other work, such as
+    extracting the features for the next frame, still runs while the model is
+    busy because waiting for a result does not block the event loop.
+
+    With ``auto_restart`` a request that fails because the runner crashed or hung
+    restarts it (once for all requests that failed on the same crash) and is
+    retried, like on ImpulseRunner.
+    """
+
+    def __init__(self, model_path: str, timeout: int = 30, allow_shm = True, max_in_flight: int = 4,
+                 freeform_output = 'list', broker: str = None, cache_size: int = 0, auto_restart = False):
+        super(AsyncImpulseRunner, self).__init__(model_path, timeout, allow_shm, freeform_output, broker,
+                                                 auto_restart=auto_restart, cache_size=cache_size)
+        self._max_in_flight = max_in_flight
+        self._writer = None
+        self._read_task = None
+        self._pending = {}
+        self._slots = None
+        self._shm_lock = None
+        self._restart_lock = None
+
+    async def init(self, debug=False, startup_timeout=STARTUP_TIMEOUT):
+        loop = asyncio.get_running_loop()
+        self._startup_timeout = startup_timeout
+        try:
+            # spawning and waiting for the socket block, keep that off the event loop
+            socket_path = await loop.run_in_executor(None, self._start_runner, debug)
+            client = await loop.run_in_executor(None, self._connect, socket_path, startup_timeout)
+
+            reader, self._writer = await asyncio.open_unix_connection(sock=client, limit=MAX_MESSAGE_SIZE)
+            self._slots = asyncio.Semaphore(self._max_in_flight)
+            if self._shm_lock is None:
+                # kept across restarts, requests may still be waiting for it
+                self._shm_lock = asyncio.Lock()
+            self._read_task = loop.create_task(self._read_loop(reader))
+
+            t_hello = time.perf_counter()
+            self._hello_resp = await self.hello()
+            self._map_shm(self._hello_resp)
+            self._negotiate(self._hello_resp)
+            self._startup_stats['hello'] = (time.perf_counter() - t_hello) * 1000
+            self._startup_stats['total'] = sum(self._startup_stats.values())
+        except BaseException:
+            self.stop()
+            raise
+
+        return self._hello_resp
+
+    async def restart(self):
+        """Coroutine version of ImpulseRunner.restart."""
+        thresholds = list(self._thresholds.values())
+        stopped = self.stop()
+        if stopped is not None:
+            await stopped
+        self._restarts = self._restarts + 1
+        hello = await self.init(self._debug, self._startup_timeout)
+        for threshold in thresholds:
+            await self.send_msg({ 'set_threshold': dict(threshold) })
+        return hello
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        stopped = self.stop()
+        if stopped is not None:
+            await stopped
+
+    def stop(self):
+        """Stops the runner without blocking the event loop.
+
+        Inside a running event loop the process is terminated in the default
+        executor; the returned future completes once it exited (``__aexit__``
+        awaits it). Returns None when there was nothing left to wait for.
+        """
+        process = self._close()
+        if process is None:
+            return None
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            _terminate_process(process)
+            return None
+        return loop.run_in_executor(None, _terminate_process, process)
+
+    def _close(self):
+        if self._read_task is not None:
+            try:
+                self._read_task.cancel()
+            except RuntimeError:
+                # event loop is already closed
+                pass
+            self._read_task = None
+
+        if self._writer is not None:
+            try:
+                self._writer.close()
+            except RuntimeError:
+                pass
+            self._writer = None
+
+        return super(AsyncImpulseRunner, self)._close()
+
+    async def hello(self):
+        return await self.send_msg({"hello": 1, "binary_protocol": BINARY_PROTOCOL_VERSION})
+
+    async def classify(self, data, freeform_output=None, freeform_out=None):
+        key, generation = None, None
+        if self._cache is not None:
+            with self._metrics.timer('cache_lookup'):
+                key = ResultCache.key(data)
+                # a set_threshold while the request is in flight starts a new generation
+                generation = self._cache.generation
+                hit = self._cache.get(key)
+            if hit is not None:
+                return self._classify_resp(hit[0], freeform_output, freeform_out, hit[1])
+
+        restarts = self._restarts
+        try:
+            return await self._classify_uncached(data, key, generation, freeform_output, freeform_out)
+        except Exception as e:
+            if isinstance(data, np.ndarray):
+                # data may be a view on the shared memory that is unmapped by a restart
+                data = data.copy()
+            if not await self._restart_after(e, restarts):
+                raise
+            return await self._classify_uncached(data, key, generation, freeform_output, freeform_out)
+
+    async def _classify_uncached(self, data, key, generation, freeform_output, freeform_out):
+        if self._input_shm is None and len(self._freeform_output_shm) == 0:
+            resp = await self.send_msg(*self._classify_msg(data))
+            if key is not None:
+                self._cache_resp(key, generation, resp)
+            return self._classify_resp(resp)
+
+        # the shared memory buffers hold a single request, keep them until the response is read
+        async with self._shm_lock:
+            resp = await self.send_msg(*self._classify_msg(data))
+            if key is not None:
+                self._cache_resp(key, generation, resp)
+            return self._classify_resp(resp, freeform_output, freeform_out)
+
+    async def classify_many(self, samples, ordered=True, prefetch=None):
+        """Async generator version of ImpulseRunner.classify_many.
+
+        Keeps up to ``prefetch`` (default ``max_in_flight``) classify requests
+        outstanding. Yields results in input order, or ``(index, result)`` tuples
+        as they complete when ``ordered`` is False.
+        """
+        prepare = self._sample_preparer()
+        max_pending = prefetch or self._max_in_flight
+        stats = self._batch_stats = { 'samples': 0, 'seconds': 0.0, 'throughput': 0.0, 'workers': 1 }
+        start = time.perf_counter()
+
+        def record():
+            stats['samples'] = stats['samples'] + 1
+            stats['seconds'] = time.perf_counter() - start
+            stats['throughput'] = stats['samples'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+
+        pending = collections.OrderedDict()
+        try:
+            for ix, sample in enumerate(samples):
+                pending[asyncio.ensure_future(self.classify(prepare(sample)))] = ix
+                while len(pending) >= max_pending:
+                    for item in await self._next_results(pending, ordered):
+                        record()
+                        yield item
+            while pending:
+                for item in await self._next_results(pending, ordered):
+                    record()
+                    yield item
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def _next_results(self, pending, ordered):
+        if ordered:
+            future, _ = pending.popitem(last=False)
+            return [await future]
+
+        done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        return [(pending.pop(future), future.result()) for future in done]
+
+    async def set_threshold(self, obj):
+        self._invalidate_cache()
+        restarts = self._restarts
+        try:
+            resp = await self.send_msg(self._set_threshold_msg(obj))
+        except Exception as e:
+            if not await self._restart_after(e, restarts):
+                raise
+            resp = await self.send_msg(self._set_threshold_msg(obj))
+        self._record_threshold(obj)
+        return resp
+
+    async def _restart_after(self, e, restarts):
+        # True when the failed request should be retried: the runner was restarted after it
+        # failed, by this call or by another request that failed on the same crash
+        if self._restart_lock is None:
+            self._restart_lock = asyncio.Lock()
+        async with self._restart_lock:
+            if self._restarts != restarts:
+                return True
+            if not self._should_restart(e):
+                return False
+            await self.restart()
+            return True
+
+    def _should_restart(self, e):
+        if not self._auto_restart or self._writer is None:
+            return False
+        # asyncio.TimeoutError is only an OSError from Python 3.11 on, a hung runner either way
+        if isinstance(e, (OSError, asyncio.TimeoutError)):
+            return True
+        return not self._is_running()
+
+    async def send_msg(self, msg, payload=None):
+        if not self._writer:
+            raise Exception("ImpulseRunner is not initialized (call init())")
+
+        if self._read_task.done():
+            raise ConnectionError("Connection to runner was closed")
+
+        async with self._slots:
+            self._ix = self._ix + 1
+            ix = self._ix
+
+            msg["id"] = ix
+            future = asyncio.get_running_loop().create_future()
+            self._pending[ix] = future
+            try:
+                t_start = time.perf_counter_ns()
+                data = _encode_msg(msg, payload)
+                t_serialized = time.perf_counter_ns()
+                self._writer.write(data)
+                await self._writer.drain()
+                t_sent = time.perf_counter_ns()
+                resp = await asyncio.wait_for(future, self._timeout)
+                t_received = time.perf_counter_ns()
+            finally:
+                self._pending.pop(ix, None)
+
+        # parsing happens in the read loop; 'read' includes waiting for earlier responses
+        metrics = self._metrics
+        metrics.record('serialize', t_serialized - t_start)
+        metrics.record('write', t_sent - t_serialized)
+        metrics.record('read', t_received - t_sent)
+        metrics.record('roundtrip', t_received - t_start)
+        metrics.record_model_timing(resp, t_received - t_start)
+
+        return _check_resp(resp)
+
+    async def _read_loop(self, reader):
+        error = ConnectionError("Connection to runner was closed")
+        try:
+            while True:
+                frame = await reader.readuntil(b"\x00")
+                try:
+                    resp = json.loads(frame[:-1])
+                except ValueError:
+                    error = Exception("No data or corrupted data received")
+                    break
+
+                future = self._pending.get(resp.get("id"))
+                # responses to requests that timed out or were cancelled are dropped
+                if future is not None and not future.done():
+                    future.set_result(resp)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError) as e:
+            if isinstance(e, asyncio.LimitOverrunError):
+                error = Exception("Response from runner exceeds " + str(MAX_MESSAGE_SIZE) + " bytes")
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(error)
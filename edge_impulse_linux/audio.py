@@ -1,9 +1,16 @@
 
+import collections
+import os
+import math
 import numpy as np
-import pyaudio
+try:
+    import pyaudio
+except ImportError:
+    # only needed to record from a microphone, files can be classified without it
+    pyaudio = None
+import threading
 import time
-from six.moves import queue
-from edge_impulse_linux.runner import ImpulseRunner as ImpulseRunner
+from edge_impulse_linux.runner import ImpulseRunner as ImpulseRunner, STARTUP_TIMEOUT
 CHUNK_SIZE = 1024
 OVERLAP = 0.25
 
@@ -11,8 +18,23 @@ def now():
     return round(time.time() * 1000)
 
 class Microphone():
-    def __init__(self, rate, chunk_size, device_id = None, channels = 1):
-        self.buff = queue.Queue()
+    """Captures audio from a PyAudio input device into a RingBuffer.
+
+    The PortAudio callback copies every chunk into a preallocated ring of int16
+    samples and signals the consumer; it does not allocate buffers or take locks
+    that the consumer holds. Consumers read NumPy views of the ring through
+    ``views()`` or use ``ring`` directly. When the consumer falls behind by more
+    than ``buffer_size`` samples, new audio is dropped and counted in ``overruns``.
+    """
+
+    def __init__(self, rate, chunk_size, device_id = None, channels = 1, buffer_size = None):
+        if pyaudio is None:
+            raise ImportError('Missing PyAudio, install via `pip3 install "edge_impulse_linux[audio]"`')
+        self.ring = RingBuffer(buffer_size or max(rate * 2, chunk_size * 8) * channels)
+        self.overruns = 0
+        self._data_ready = threading.Event()
+        # compared against every chunk to detect a dead input, allocated once
+        self._silence = bytes(chunk_size * 2 * channels)
         self.chunk_size = chunk_size
         self.data = []
         self.rate = rate
@@ -90,48 +112,330 @@ class Microphone():
         self.interface.terminate()
 
     def fill_buffer(self, in_data, frame_count, time_info, status_flags):
-        zeros=bytes(self.chunk_size*2)
-        if in_data != zeros:
+        # runs on the PortAudio thread, keep this cheap
+        if in_data != self._silence:
             self.zero_counter = 0
         else:
             self.zero_counter+=1
 
         if self.zero_counter > self.rate / self.chunk_size:
             self.closed = True
+            self._data_ready.set()
             raise Exception('There is no audio data comming from the audio interface')
 
-        self.buff.put(in_data)
+        samples = np.frombuffer(in_data, dtype=np.int16)
+        written = self.ring.write(samples)
+        if written < len(samples):
+            self.overruns = self.overruns + len(samples) - written
+        self._data_ready.set()
         return None, pyaudio.paContinue
 
-    def generator(self):
+    def wait(self, timeout=None):
+        """Blocks until new audio arrives (or the timeout expires)."""
+        self._data_ready.wait(timeout)
+        self._data_ready.clear()
+
+    def views(self):
+        """Yields NumPy views of all audio captured since the previous iteration.
+
+        A view is only valid until the generator is resumed, copy it to keep it.
+        """
         while not self.closed:
-            chunk = self.buff.get()
+            n = len(self.ring)
+            if n == 0:
+                self.wait(0.1)
+                continue
+            yield self.ring.peek(n)
+            self.ring.consume(n)
+
+    def generator(self):
+        for view in self.views():
+            yield view.tobytes()
+
+class RingBuffer:
+    """Fixed-size circular buffer of samples that hands out windows as views.
+
+    Every sample is stored twice, at ``i`` and ``i + capacity`` of a buffer of
+    twice the capacity, so any run of up to ``capacity`` buffered samples is
+    contiguous and ``peek`` never has to copy. Safe for one writer thread and
+    one reader thread: ``write`` only moves the write position and ``consume``
+    only moves the read position.
+    """
+
+    def __init__(self, capacity, dtype=np.int16):
+        self.capacity = capacity
+        self._buf = np.zeros((2 * capacity,), dtype=dtype)
+        self._read = 0      # total number of samples consumed
+        self._write = 0     # total number of samples written
+
+    def __len__(self):
+        return self._write - self._read
+
+    def free(self):
+        return self.capacity - len(self)
+
+    def write(self, samples):
+        """Append as many samples as fit, returns how many were written."""
+        n = min(len(samples), self.free())
+        pos = self._write % self.capacity
+        first = min(n, self.capacity - pos)
+        rest = n - first
+        buf = self._buf
+        buf[pos:pos + first] = samples[:first]
+        buf[pos + self.capacity:pos + self.capacity + first] = samples[:first]
+        if rest > 0:
+            buf[:rest] = samples[first:n]
+            buf[self.capacity:self.capacity + rest] = samples[first:n]
+        self._write = self._write + n
+        return n
+
+    def peek(self, n):
+        """View of the oldest ``n`` buffered samples, valid until they are consumed."""
+        if n > len(self):
+            raise Exception('Cannot peek ' + str(n) + ' samples, only ' + str(len(self)) + ' buffered')
+        pos = self._read % self.capacity
+        return self._buf[pos:pos + n]
+
+    def consume(self, n):
+        """Drop the oldest ``n`` samples."""
+        self._read = self._read + min(n, len(self))
+
+class EnergyGate:
+    """Marks windows whose RMS level is below a threshold (in dB relative to full scale) as silent.
+
+    The level is computed with a float32 dot product into a preallocated buffer,
+    so checking a window allocates no memory.
+    """
+
+    def __init__(self, window_size, threshold_db):
+        self.threshold_db = threshold_db
+        # compare the sum of squares instead of taking a log per window
+        self._threshold = window_size * (32768.0 * 10 ** (threshold_db / 20)) ** 2
+        self._buf = np.empty((window_size,), dtype=np.float32)
+
+    def is_silent(self, window):
+        buf = self._buf[:len(window)]
+        np.copyto(buf, window)
+        return float(np.dot(buf, buf)) < self._threshold * len(window) / len(self._buf)
+
+
+class ResultSmoother:
+    """Smooths consecutive classification results.
+
+    Args:
+        mode (str): 'average' returns the moving average of the scores, 'vote' returns
+            for every label the share of the last results in which it had the top score.
+        count (int): Number of consecutive results to smooth over.
+    """
+
+    def __init__(self, mode='average', count=3):
+        if mode not in ('average', 'vote'):
+            raise ValueError('Invalid value for smoothing, should be average or vote')
+        self.mode = mode
+        self._history = collections.deque(maxlen=count)
+
+    def reset(self):
+        self._history.clear()
+
+    def update(self, classification):
+        if self.mode == 'vote':
+            self._history.append(max(classification, key=classification.get))
+            return { label: self._history.count(label) / len(self._history) for label in classification }
+
+        self._history.append(classification)
+        return { label: sum(c[label] for c in self._history) / len(self._history) for label in classification }
+
+
+def _lowpass_kernel(ratio, zero_crossings=32):
+    """Blackman-windowed sinc low-pass for downsampling by ``ratio``, as float32 taps.
+
+    The cutoff sits half a transition band below the output Nyquist frequency,
+    so the stopband (about -74 dB) starts at the new Nyquist frequency.
+    """
+    half = int(math.ceil(zero_crossings * ratio))
+    taps = 2 * half + 1
+    # transition width of a Blackman window, in cycles per input sample
+    transition = 5.5 / taps
+    cutoff = max(0.5 / ratio - transition / 2, 0.25 / ratio)
+    n = np.arange(-half, half + 1)
+    kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.blackman(taps)
+    return (kernel / kernel.sum()).astype(np.float32)
+
+
+class AudioFileSource:
+    """Memory-mapped audio from a WAV file or raw PCM data.
+
+    Only the parts of the file that are read are paged in, so hours of audio can
+    be processed without loading them into memory. WAV files must contain 8, 16
+    or 32 bit integer PCM or 32 bit float samples. Raw PCM files need the
+    ``sample_rate`` (and ``channels`` / ``dtype`` if not mono int16).
+
+    Args:
+        path (str): The file to read.
+        sample_rate (int): Sample rate of raw PCM files, ignored for WAV files.
+        channels (int): Number of interleaved channels of raw PCM files.
+        dtype: Sample type of raw PCM files.
+    """
+
+    def __init__(self, path, sample_rate=None, channels=1, dtype=np.int16):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(12)
+
+        if header[0:4] == b'RIFF' and header[8:12] == b'WAVE':
+            offset, length, self.sample_rate, self.channels, dtype = self._parse_wav(path)
+        else:
+            if not sample_rate:
+                raise Exception('sample_rate is required for raw PCM file "' + path + '"')
+            offset, length = 0, None
+            self.sample_rate = sample_rate
+            self.channels = channels
+
+        dtype = np.dtype(dtype)
+        count = (length // dtype.itemsize) if length is not None else -1
+        data = np.memmap(path, dtype=dtype, mode='r', offset=offset,
+                         shape=(count,) if count >= 0 else None)
+        frames = len(data) // self.channels
+        self.samples = data[:frames * self.channels].reshape(frames, self.channels)
+
+    @property
+    def frames(self):
+        return self.samples.shape[0]
 
-            if chunk is None:
-                return
+    @property
+    def duration(self):
+        return self.frames / self.sample_rate
 
-            data = [chunk]
+    def read(self, start, end):
+        """Returns frames ``start`` to ``end`` mixed down to mono, as float32 in int16 range."""
+        block = self.samples[start:end]
+        if block.dtype == np.uint8:
+            block = (block.astype(np.float32) - 128) * 256
+        elif block.dtype == np.int32:
+            block = block.astype(np.float32) / 65536
+        elif block.dtype == np.float32:
+            block = block * 32767
+        else:
+            block = block.astype(np.float32)
+        return block.mean(axis=1) if self.channels > 1 else block[:, 0]
+
+    def resampled(self, sample_rate, block_size=65536):
+        """Yields the audio mixed down to mono and resampled to ``sample_rate``, as int16 blocks.
+
+        Resampling uses vectorized linear interpolation over blocks of
+        ``block_size`` output samples, positions are computed from the start of
+        the file so there are no seams between blocks. When downsampling, the
+        audio first goes through a windowed-sinc low-pass filter that removes
+        everything above the new Nyquist frequency, which would otherwise alias
+        into the band the model sees.
+        """
+        ratio = self.sample_rate / sample_rate
+        kernel = _lowpass_kernel(ratio) if ratio > 1 else None
+        half = len(kernel) // 2 if kernel is not None else 0
+        total = int(self.frames / ratio)
+        for k0 in range(0, total, block_size):
+            k1 = min(total, k0 + block_size)
+            if self.sample_rate == sample_rate:
+                block = self.read(k0, k1)
+            else:
+                positions = np.arange(k0, k1, dtype=np.float64) * ratio
+                first = int(positions[0])
+                last = min(self.frames, int(positions[-1]) + 2)
+                if kernel is None:
+                    source = self.read(first, last)
+                else:
+                    # filter with enough context on both sides that blocks join seamlessly
+                    source = np.convolve(self._read_padded(first - half, last + half), kernel, mode='valid')
+                block = np.interp(positions - first, np.arange(last - first), source)
+            yield np.clip(np.round(block), -32768, 32767).astype(np.int16)
+
+    def _read_padded(self, start, end):
+        # like read(), with silence before the start and after the end of the file
+        block = self.read(max(0, start), min(self.frames, end))
+        return np.pad(block, (max(0, -start), max(0, end - self.frames)))
+
+    def _parse_wav(self, path):
+        fmt = None
+        with open(path, 'rb') as f:
+            f.seek(12)
             while True:
-                try:
-                    chunk = self.buff.get(block=False)
-                    if chunk is None:
-                        return
-                    data.append(chunk)
-                except queue.Empty:
+                chunk = f.read(8)
+                if len(chunk) < 8:
+                    raise Exception('No data chunk in WAV file "' + path + '"')
+                chunk_id = chunk[0:4]
+                chunk_size = int.from_bytes(chunk[4:8], 'little')
+                if chunk_id == b'fmt ':
+                    fmt = f.read(chunk_size)
+                    f.seek(chunk_size % 2, 1)
+                elif chunk_id == b'data':
+                    if fmt is None:
+                        raise Exception('No fmt chunk before data in WAV file "' + path + '"')
+                    offset = f.tell()
                     break
+                else:
+                    # chunks are padded to an even size
+                    f.seek(chunk_size + chunk_size % 2, 1)
+
+        audio_format = int.from_bytes(fmt[0:2], 'little')
+        channels = int.from_bytes(fmt[2:4], 'little')
+        sample_rate = int.from_bytes(fmt[4:8], 'little')
+        bits = int.from_bytes(fmt[14:16], 'little')
+        if audio_format == 0xFFFE and len(fmt) >= 26:
+            # WAVE_FORMAT_EXTENSIBLE, the real format is in the sub format GUID
+            audio_format = int.from_bytes(fmt[24:26], 'little')
+
+        dtypes = { (1, 8): np.uint8, (1, 16): np.int16, (1, 32): np.int32, (3, 32): np.float32 }
+        if (audio_format, bits) not in dtypes:
+            raise Exception('Unsupported WAV format ' + str(audio_format) + ' with ' + str(bits) + ' bits in "' + path + '"')
+
+        # the data chunk size is 0 or bogus in files that were being streamed, use the file size then
+        length = min(chunk_size, os.path.getsize(path) - offset) if chunk_size > 0 else os.path.getsize(path) - offset
+        return offset, length, sample_rate, channels, dtypes[(audio_format, bits)]
+
+
+class AudioTimeline:
+    """Compact timeline of per-window results from AudioImpulseRunner.classify_file.
+
+    Attributes:
+        starts (numpy.ndarray): Start time (seconds) of every window.
+        window_duration (float): Length of a window in seconds.
+        labels (list): The model labels, the columns of ``scores``.
+        scores (numpy.ndarray): float32 scores, one row per window (classification models).
+        results (list): The raw result of every window, for other model types.
+        stats (dict): Audio duration, processing time, windows/s and the x-real-time factor.
+    """
+
+    def __init__(self, labels, window_duration):
+        self.labels = labels
+        self.window_duration = window_duration
+        self.starts = np.empty((0,), dtype=np.float64)
+        self.scores = np.empty((0, len(labels)), dtype=np.float32)
+        self.results = []
+        self.stats = {}
+
+    def __len__(self):
+        return len(self.starts)
+
+    def top(self):
+        """Returns ``(start, label, score)`` for the highest scoring label of every window."""
+        best = self.scores.argmax(axis=1)
+        return [(float(start), self.labels[ix], float(self.scores[row, ix]))
+                for row, (start, ix) in enumerate(zip(self.starts, best))]
 
-            yield b''.join(data)
 
 class AudioImpulseRunner(ImpulseRunner):
-    def __init__(self, model_path: str):
-        super(AudioImpulseRunner, self).__init__(model_path)
+    def __init__(self, model_path: str, timeout: int = 30, allow_shm = True, freeform_output = 'list',
+                 broker: str = None, auto_restart = False, cache_size: int = 0):
+        super(AudioImpulseRunner, self).__init__(model_path, timeout, allow_shm, freeform_output, broker, auto_restart,
+                                 cache_size)
         self.closed = True
         self.sampling_rate = 0
         self.window_size = 0
         self.labels = []
+        self._stream_stats = None
 
-    def init(self, debug=False):
-        model_info = super(AudioImpulseRunner, self).init(debug)
+    def init(self, debug=False, startup_timeout=STARTUP_TIMEOUT):
+        model_info = super(AudioImpulseRunner, self).init(debug, startup_timeout)
         if model_info['model_parameters']['frequency'] == 0:
             raise Exception('Model file "' + self._model_path + '" is not suitable for audio recognition')
 
@@ -148,19 +452,172 @@ class AudioImpulseRunner(ImpulseRunner):
     def __exit__(self, type, value, traceback):
         self.closed = True
 
-    def classify(self, data):
-        return super(AudioImpulseRunner, self).classify(data)
-
-    def classifier(self, device_id = None):
-        with Microphone(self.sampling_rate, CHUNK_SIZE, device_id=device_id) as mic:
-            generator = mic.generator()
-            features = np.array([], dtype=np.int16)
-            while not self.closed:
-                for audio in generator:
-                    data = np.frombuffer(audio, dtype=np.int16)
-                    features = np.concatenate((features, data), axis=0)
-                    while len(features) >= self.window_size:
-                        begin = now()
-                        res = self.classify(features[:self.window_size].tolist())
-                        features = features[int(self.window_size * OVERLAP):]
-                        yield res, audio
+    def classify(self, data, freeform_output=None, freeform_out=None):
+        return super(AudioImpulseRunner, self).classify(data, freeform_output, freeform_out)
+
+    def _sample_preparer(self):
+        # classify_many samples are windows of window_size int16 samples
+        def prepare(window):
+            window = np.asarray(window, dtype=np.int16)
+            if len(window) != self.window_size:
+                raise Exception('Expected windows of ' + str(self.window_size) + ' samples, got ' + str(len(window)))
+            return window
+
+        return prepare
+
+    def classifier(self, device_id = None, hop_size = None):
+        """Classify audio from a microphone, yields (result, audio) tuples.
+
+        A window of ``window_size`` samples is classified every ``hop_size``
+        samples (default: ``OVERLAP`` times the window size). The microphone
+        writes into a fixed-size RingBuffer, so no memory is allocated per chunk
+        and each window is passed to the runner without intermediate copies.
+        ``audio`` is an int16 NumPy view of the classified window, valid until
+        the generator is resumed.
+        """
+        for window in self._windows(device_id, hop_size or int(self.window_size * OVERLAP)):
+            res = self.classify(window)
+            yield res, window
+
+    def streaming_classifier(self, device_id = None, stride_ms = None, silence_threshold_db = None,
+                             smoothing = None, smoothing_count = 3):
+        """Classify audio from a microphone with a configurable stride, gating and smoothing.
+
+        Args:
+            device_id: The audio device to use, asks when not given.
+            stride_ms (float): Time between the start of consecutive windows, defaults
+                to ``OVERLAP`` times the window length.
+            silence_threshold_db (float): If set, windows with an RMS level below this
+                many dB relative to full scale (e.g. -50) are not classified.
+            smoothing (str): 'average' for a moving average of the scores, 'vote' for a
+                majority vote over the top labels, or None.
+            smoothing_count (int): Number of consecutive results to smooth over.
+
+        Yields (result, audio) tuples like ``classifier``. With smoothing, the
+        smoothed scores replace ``result['classification']`` and the raw scores are
+        kept in ``result['classification_raw']``. Silent windows yield nothing and
+        reset the smoothing. Window, inference and skip counts are available from
+        ``stream_stats()``.
+        """
+        if stride_ms is not None:
+            hop_size = int(round(stride_ms * self.sampling_rate / 1000))
+        else:
+            hop_size = int(self.window_size * OVERLAP)
+
+        smoother = ResultSmoother(smoothing, smoothing_count) if smoothing else None
+        gate = EnergyGate(self.window_size, silence_threshold_db) if silence_threshold_db is not None else None
+        stats = self._stream_stats = { 'windows': 0, 'inferences': 0, 'skipped': 0,
+                                       'window_rate': 0.0, 'inference_rate': 0.0 }
+        start = time.perf_counter()
+
+        def update_rates():
+            elapsed = time.perf_counter() - start
+            if elapsed > 0:
+                stats['window_rate'] = stats['windows'] / elapsed
+                stats['inference_rate'] = stats['inferences'] / elapsed
+
+        for window in self._windows(device_id, hop_size):
+            stats['windows'] = stats['windows'] + 1
+            silent = False
+            if gate is not None:
+                with self._metrics.timer('audio_gate'):
+                    silent = gate.is_silent(window)
+            if silent:
+                stats['skipped'] = stats['skipped'] + 1
+                if smoother is not None:
+                    smoother.reset()
+                update_rates()
+                continue
+
+            res = self.classify(window)
+            stats['inferences'] = stats['inferences'] + 1
+            update_rates()
+            if smoother is not None and 'classification' in res.get('result', {}):
+                with self._metrics.timer('audio_smoothing'):
+                    res['result']['classification_raw'] = res['result']['classification']
+                    res['result']['classification'] = smoother.update(res['result']['classification'])
+            yield res, window
+
+    def stream_stats(self):
+        """Windows seen, inferences run, windows skipped by the gate, and the rates (per second)
+        of the last streaming_classifier run."""
+        return self._stream_stats
+
+    def classify_file(self, path, stride_ms = None, sample_rate = None, channels = 1, dtype = np.int16, workers = 1):
+        """Classify a WAV or raw PCM file as fast as the model allows.
+
+        The file is memory-mapped, mixed down to mono and resampled to the model
+        frequency, then every window (``stride_ms`` apart, by default ``OVERLAP``
+        times the window length) is classified through ``classify_many``, so the
+        next windows are prepared while the model runs and ``workers`` > 1 fans out
+        over multiple runner processes.
+
+        Args:
+            path (str): WAV file, or raw PCM file (requires ``sample_rate``).
+            stride_ms (float): Time between the start of consecutive windows.
+            sample_rate, channels, dtype: Format of raw PCM files.
+            workers (int): Number of runner processes.
+
+        Returns:
+            AudioTimeline: Per-window results, with throughput in ``stats``.
+        """
+        source = AudioFileSource(path, sample_rate=sample_rate, channels=channels, dtype=dtype)
+        if stride_ms is not None:
+            hop_size = int(round(stride_ms * self.sampling_rate / 1000))
+        else:
+            hop_size = int(self.window_size * OVERLAP)
+        if hop_size < 1:
+            raise Exception('stride_ms should be at least one sample')
+
+        def windows():
+            ring = RingBuffer(self.window_size + 65536)
+            for block in source.resampled(self.sampling_rate):
+                while len(block) > 0:
+                    block = block[ring.write(block):]
+                    while len(ring) >= self.window_size:
+                        # copied, the window is classified on another thread
+                        yield ring.peek(self.window_size).copy()
+                        ring.consume(hop_size)
+
+        timeline = AudioTimeline(self.labels, self.window_size / self.sampling_rate)
+        scores = []
+        start = time.perf_counter()
+        for res in self.classify_many(windows(), workers=workers):
+            classification = res.get('result', {}).get('classification')
+            if classification is not None:
+                scores.append([classification[label] for label in self.labels])
+            else:
+                timeline.results.append(res['result'])
+        elapsed = time.perf_counter() - start
+
+        count = len(scores) + len(timeline.results)
+        timeline.starts = np.arange(count, dtype=np.float64) * hop_size / self.sampling_rate
+        if len(scores) > 0:
+            timeline.scores = np.array(scores, dtype=np.float32)
+        timeline.stats = {
+            'duration': source.duration,
+            'windows': count,
+            'seconds': elapsed,
+            'windows_per_second': count / elapsed if elapsed > 0 else 0.0,
+            'realtime_factor': source.duration / elapsed if elapsed > 0 else 0.0,
+        }
+        return timeline
+
+    def _windows(self, device_id, hop_size):
+        if hop_size < 1 or hop_size > self.window_size:
+            raise Exception('hop_size should be between 1 and the window size (' + str(self.window_size) + ')')
+
+        with Microphone(self.sampling_rate, CHUNK_SIZE, device_id=device_id,
+                        buffer_size=self.window_size + hop_size + CHUNK_SIZE * 8) as mic:
+            # the microphone callback writes into this ring, windows are read from it in place
+            ring = mic.ring
+            while not self.closed and not mic.closed:
+                if len(ring) > ring.capacity - CHUNK_SIZE:
+                    # inference is falling behind the microphone, skip ahead to the newest audio
+                    ring.consume(len(ring) - self.window_size)
+                if len(ring) < self.window_size:
+                    mic.wait(0.1)
+                    continue
+
+                yield ring.peek(self.window_size)
+                ring.consume(hop_size)
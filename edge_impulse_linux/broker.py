@@ -0,0 +1,345 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from edge_impulse_linux.runner import MessageReader, STARTUP_TIMEOUT, _check_model_file, _check_resp, _terminate_process
+
+# seconds the broker waits for a runner while reading or resetting its thresholds
+CONTROL_TIMEOUT = 5
+
+class _WarmRunner:
+    def __init__(self, key, model_path, process, tempdir, socket_path):
+        self.key = key
+        self.model_path = model_path
+        self.process = process
+        self.tempdir = tempdir
+        self.socket_path = socket_path
+        self.leased = True
+        self.last_used = time.monotonic()
+        self.leases = 0
+        # as reported in hello before any client could change them
+        self.default_thresholds = []
+
+class RunnerBroker:
+    """Keeps model processes running and leases them to short-lived clients.
+
+    Starting a model means spawning the .eim, loading the model and mapping its
+    shared memory, which can take seconds. The broker keeps runners warm between
+    clients: an ``ImpulseRunner(model_path, broker=socket_path)`` asks the broker
+    for a runner, then talks to that runner over its own socket exactly as if it
+    had started it. When the client stops (or its process exits) the runner goes
+    back to the broker and the next client gets it right away.
+
+    Runners are keyed by a hash of the model file, so copies of the same model
+    share warm runners, and an updated model file is never served by a runner
+    that still has the old one loaded. A runner is leased to one client at a
+    time; if all runners for a model are leased a new one is started.
+
+    Idle runners are stopped, least recently used first, when the resident
+    memory of all runners exceeds ``memory_budget`` bytes, and when they have
+    been idle for longer than ``idle_timeout`` seconds.
+
+    Thresholds changed with ``set_threshold`` live in the runner process. The
+    broker reads the model's thresholds when it starts a runner, and sets them
+    back when a lease ends, so every client starts from the model defaults.
+    A runner whose thresholds cannot be reset is stopped.
+
+    The control protocol uses the same framing as the runner: JSON messages
+    terminated by \\x00 in both directions, ``{"id": 1, "lease": "/path/to/model.eim"}``,
+    ``{"id": 2, "release": <lease id>}`` and ``{"id": 3, "status": 1}``. A
+    connection can only release its own leases, they are all released when it
+    closes.
+
+    Run it with ``python -m edge_impulse_linux.broker --socket /tmp/ei-broker.sock``.
+
+    Args:
+        socket_path (str): Path of the Unix socket the broker listens on.
+        memory_budget (int): Resident memory, in bytes, that idle runners may use in total.
+        idle_timeout (float): Stop runners that have not been leased for this many seconds.
+        debug (bool): Show the output of the runners.
+    """
+
+    def __init__(self, socket_path: str, memory_budget: int = None, idle_timeout: float = None, debug = False):
+        self._socket_path = socket_path
+        self._memory_budget = memory_budget
+        self._idle_timeout = idle_timeout
+        self._debug = debug
+        self._server = None
+        self._runners = []
+        self._leases = {}
+        self._lease_ix = 0
+        self._keys = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def serve_forever(self):
+        if os.path.exists(self._socket_path):
+            os.unlink(self._socket_path)
+
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self._socket_path)
+        self._server.listen()
+        # wake up every second to stop idle runners
+        self._server.settimeout(1.0)
+        self._stopped.clear()
+
+        while not self._stopped.is_set():
+            try:
+                conn, _ = self._server.accept()
+            except socket.timeout:
+                self._evict()
+                continue
+            except OSError:
+                # closed by stop()
+                break
+            conn.settimeout(None)
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            if os.path.exists(self._socket_path):
+                os.unlink(self._socket_path)
+
+        with self._lock:
+            runners = self._runners
+            self._runners = []
+            self._leases = {}
+        for runner in runners:
+            self._stop_runner(runner)
+
+    def status(self):
+        """One dict per runner with the model path, pid, lease state and resident memory."""
+        with self._lock:
+            return [{
+                'model_path': r.model_path,
+                'key': r.key,
+                'pid': r.process.pid,
+                'leased': r.leased,
+                'leases': r.leases,
+                'idle_seconds': 0 if r.leased else time.monotonic() - r.last_used,
+                'rss': _rss(r.process.pid),
+            } for r in self._runners]
+
+    def _handle(self, conn):
+        reader = MessageReader(conn)
+        leases = set()
+        try:
+            while True:
+                msg = reader.read_message()
+                try:
+                    if 'lease' in msg:
+                        lease_id, runner = self._lease(msg['lease'])
+                        leases.add(lease_id)
+                        resp = { 'lease': lease_id, 'socket': runner.socket_path, 'warm': runner.leases > 1 }
+                    elif 'release' in msg:
+                        # only leases taken on this connection, others belong to other clients
+                        if not msg['release'] in leases:
+                            raise Exception('Unknown lease ' + str(msg['release']) + ' on this connection')
+                        leases.discard(msg['release'])
+                        self._release(msg['release'])
+                        resp = {}
+                    elif 'status' in msg:
+                        resp = { 'runners': self.status() }
+                    else:
+                        raise Exception('Unknown message, expected "lease", "release" or "status"')
+                    resp['success'] = True
+                except Exception as e:
+                    resp = { 'success': False, 'error': str(e) }
+                resp['id'] = msg.get('id')
+                conn.sendall(json.dumps(resp).encode('utf-8') + b'\x00')
+        except Exception:
+            # client went away (or sent garbage), its leases end with the connection
+            pass
+        finally:
+            conn.close()
+            for lease_id in leases:
+                self._release(lease_id)
+
+    def _lease(self, model_path):
+        _check_model_file(model_path)
+        key = self._model_key(model_path)
+
+        with self._lock:
+            self._runners = [r for r in self._runners if r.leased or self._check_alive(r)]
+            runner = next((r for r in self._runners if r.key == key and not r.leased), None)
+            if runner is None:
+                runner = self._start_runner(key, model_path)
+                self._runners.append(runner)
+            runner.leased = True
+            runner.leases = runner.leases + 1
+            self._lease_ix = self._lease_ix + 1
+            lease_id = self._lease_ix
+            self._leases[lease_id] = runner
+
+        if runner.leases == 1:
+            try:
+                self._wait_for_socket(runner)
+                runner.default_thresholds = self._read_thresholds(runner)
+            except Exception:
+                self._release(lease_id)
+                raise
+
+        self._evict()
+        return lease_id, runner
+
+    def _release(self, lease_id):
+        with self._lock:
+            runner = self._leases.pop(lease_id, None)
+            if runner is None:
+                return
+
+        # still marked as leased, so no other client gets it before the reset
+        try:
+            self._reset_thresholds(runner)
+        except Exception:
+            # crashed or hung, don't hand it out again
+            with self._lock:
+                self._runners = [r for r in self._runners if r is not runner]
+            self._stop_runner(runner)
+            return
+
+        with self._lock:
+            runner.leased = False
+            runner.last_used = time.monotonic()
+        self._evict()
+
+    def _read_thresholds(self, runner):
+        hello = self._request(runner, [{ 'hello': 1 }])[0]
+        return hello.get('model_parameters', {}).get('thresholds', [])
+
+    def _reset_thresholds(self, runner):
+        # the type is informational, set_threshold only takes the id and the values
+        msgs = [{ 'set_threshold': { k: v for k, v in t.items() if k != 'type' } }
+                for t in runner.default_thresholds]
+        if len(msgs) > 0:
+            self._request(runner, msgs)
+
+    def _request(self, runner, msgs):
+        # the runner serves one client at a time, only connect while it is not leased out
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.settimeout(CONTROL_TIMEOUT)
+        try:
+            conn.connect(runner.socket_path)
+            reader = MessageReader(conn, 4096)
+            resps = []
+            for ix, msg in enumerate(msgs):
+                msg['id'] = ix + 1
+                conn.sendall(json.dumps(msg).encode('utf-8') + b'\x00')
+                resps.append(_check_resp(reader.read_message()))
+            return resps
+        finally:
+            conn.close()
+
+    def _evict(self):
+        with self._lock:
+            now = time.monotonic()
+            idle = sorted([r for r in self._runners if not r.leased], key=lambda r: r.last_used)
+            evicted = [r for r in idle if r.process.poll() is not None or
+                (self._idle_timeout is not None and now - r.last_used > self._idle_timeout)]
+
+            if self._memory_budget is not None:
+                total = sum(_rss(r.process.pid) for r in self._runners if r not in evicted)
+                for r in idle:
+                    if total <= self._memory_budget:
+                        break
+                    if r not in evicted:
+                        total = total - _rss(r.process.pid)
+                        evicted.append(r)
+
+            self._runners = [r for r in self._runners if r not in evicted]
+
+        for runner in evicted:
+            self._stop_runner(runner)
+
+    def _check_alive(self, runner):
+        if runner.process.poll() is None:
+            return True
+        shutil.rmtree(runner.tempdir, ignore_errors=True)
+        return False
+
+    def _model_key(self, model_path):
+        st = os.stat(model_path)
+        cache_key = (os.path.abspath(model_path), st.st_size, st.st_mtime_ns)
+        key = self._keys.get(cache_key)
+        if key is None:
+            h = hashlib.sha256()
+            with open(model_path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    h.update(block)
+            key = self._keys[cache_key] = h.hexdigest()
+        return key
+
+    def _start_runner(self, key, model_path):
+        tempdir = tempfile.mkdtemp()
+        socket_path = os.path.join(tempdir, "runner.sock")
+        cmd = [os.path.abspath(model_path), socket_path]
+        if self._debug:
+            process = subprocess.Popen(cmd)
+        else:
+            process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return _WarmRunner(key, model_path, process, tempdir, socket_path)
+
+    def _wait_for_socket(self, runner):
+        # don't connect to probe readiness, that would occupy the runner's only client slot
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        delay = 0.001
+        while not os.path.exists(runner.socket_path):
+            if runner.process.poll() is not None:
+                raise Exception("Failed to start runner (" + str(runner.process.poll()) + ")")
+            if time.monotonic() >= deadline:
+                raise Exception("Runner did not create its socket within " + str(STARTUP_TIMEOUT) + " seconds")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+    def _stop_runner(self, runner):
+        _terminate_process(runner.process)
+        shutil.rmtree(runner.tempdir, ignore_errors=True)
+
+
+def _rss(pid):
+    # resident set size in bytes, 0 where /proc is not available
+    try:
+        with open('/proc/' + str(pid) + '/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Keeps Edge Impulse models warm for ImpulseRunner(..., broker=<socket>)')
+    parser.add_argument('--socket', required=True, help='Path of the Unix socket to listen on')
+    parser.add_argument('--memory-budget', type=float, help='Memory (in MB) idle runners may use before they are stopped')
+    parser.add_argument('--idle-timeout', type=float, help='Stop runners that have been idle for this many seconds')
+    parser.add_argument('--debug', action='store_true', help='Show the output of the runners')
+    args = parser.parse_args()
+
+    broker = RunnerBroker(args.socket,
+        memory_budget=int(args.memory_budget * 1024 * 1024) if args.memory_budget is not None else None,
+        idle_timeout=args.idle_timeout, debug=args.debug)
+
+    def shutdown(sig, frame):
+        broker.stop()
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    broker.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import collections
+import copy
+import hashlib
+import threading
+import numpy as np
+
+class ResultCache:
+    """LRU cache of classify results, keyed by a hash of the input.
+
+    Meant for inputs that are classified again and again, e.g. re-scoring a
+    dataset or trying out thresholds on the same samples. The key is a 128 bit
+    BLAKE2b digest over the dtype and the raw bytes of the features, so a list
+    and a float64 array with the same values share an entry, but a float32 array
+    does not.
+
+    Results are deep copied when they are stored and when they are returned,
+    so callers can modify them freely. Freeform outputs from shared memory are
+    stored as read-only copies (see ``ImpulseRunner._classify_resp``).
+
+    Every ``clear()`` starts a new generation; results of requests that were
+    sent before the cache was cleared (e.g. before a ``set_threshold``) are not
+    stored, so a threshold update never leads to stale results.
+
+    Args:
+        max_entries (int): Number of results kept, least recently used ones are evicted first.
+    """
+
+    def __init__(self, max_entries=1024):
+        if max_entries <= 0:
+            raise ValueError('max_entries should be larger than 0')
+        self.max_entries = max_entries
+        self.generation = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(data):
+        array = np.ascontiguousarray(data)
+        h = hashlib.blake2b(array.dtype.str.encode('ascii'), digest_size=16)
+        h.update(array.data.cast('B'))
+        return h.digest()
+
+    def get(self, key):
+        """The cached ``(response, freeform_arrays)`` for ``key``, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses = self.misses + 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits = self.hits + 1
+        resp, freeform = entry
+        return copy.deepcopy(resp), freeform
+
+    def put(self, key, generation, resp, freeform=None):
+        """Store a response (and its freeform outputs) for a request sent in ``generation``."""
+        resp = copy.deepcopy(resp)
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (resp, freeform)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions = self.evictions + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries = collections.OrderedDict()
+            self.generation = self.generation + 1
+            self.invalidations = self.invalidations + 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups > 0 else 0.0,
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
@@ -2,27 +2,38 @@
 
 import numpy as np
 import sys
+import threading
+import time
 try:
     import cv2
-except ImportError:
-    print('Missing OpenCV, install via `pip3 install "opencv-python>=4.5.1.48,<5"`')
-    exit(1)
+except ImportError as e:
+    raise ImportError('Missing OpenCV, install via `pip3 install "edge_impulse_linux[image]"` '
+                      'or `pip3 install "opencv-python>=4.5.1.48,<5"`') from e
 
-from edge_impulse_linux.runner import ImpulseRunner
+from edge_impulse_linux.runner import ImpulseRunner, STARTUP_TIMEOUT
+from edge_impulse_linux.pipeline import Pipeline, StageStats
 import math
+import functools
 
 class ImageImpulseRunner(ImpulseRunner):
-    def __init__(self, model_path: str):
-        super(ImageImpulseRunner, self).__init__(model_path)
+    def __init__(self, model_path: str, timeout: int = 30, allow_shm = True, freeform_output = 'list',
+                 broker: str = None, auto_restart = False, cache_size: int = 0):
+        super(ImageImpulseRunner, self).__init__(model_path, timeout, allow_shm, freeform_output, broker, auto_restart,
+                                 cache_size)
         self.closed = True
         self.labels = []
         self.dim = (0, 0)
         self.videoCapture = cv2.VideoCapture()
         self.isGrayscale = False
         self.resizeMode = ''
-
-    def init(self, debug=False):
-        model_info = super(ImageImpulseRunner, self).init(debug)
+        self._extractor = None
+        self._pipeline = None
+        self._frame_reader = None
+        self._glass_to_result = None
+        self._motion_gate = None
+
+    def init(self, debug=False, startup_timeout=STARTUP_TIMEOUT):
+        model_info = super(ImageImpulseRunner, self).init(debug, startup_timeout)
         width = model_info['model_parameters']['image_input_width']
         height = model_info['model_parameters']['image_input_height']
 
@@ -44,42 +55,247 @@ class ImageImpulseRunner(ImpulseRunner):
         self.videoCapture.release()
         self.closed = True
 
-    def classify(self, data):
-        return super(ImageImpulseRunner, self).classify(data)
+    def classify(self, data, freeform_output=None, freeform_out=None):
+        return super(ImageImpulseRunner, self).classify(data, freeform_output, freeform_out)
 
     # This returns images in RGB format (not BGR)
-    def get_frames(self, videoDeviceId = 0):
+    def get_frames(self, videoDeviceId = 0, latest_frame_only = None):
+        """Yields RGB frames from a camera, stream or video file.
+
+        See ``classifier`` for ``latest_frame_only``: by default every frame of a
+        video file is returned, and only the newest frame of a live source.
+        """
         if sys.platform == "darwin":
             print('Make sure to grant the this script access to your webcam.')
             print('If your webcam is not responding, try running "tccutil reset Camera" to reset the camera access privileges.')
 
         self.videoCapture = cv2.VideoCapture(videoDeviceId)
-        while not self.closed:
-            success, img = self.videoCapture.read()
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            if success:
+        with LatestFrameReader(self.videoCapture, latest_only=latest_frame_only) as reader:
+            while not self.closed:
+                success, img, _ = reader.read()
+                if not success:
+                    break
+                img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
                 yield img
 
     # This returns images in RGB format (not BGR)
-    def classifier(self, videoDeviceId = 0):
+    def classifier(self, videoDeviceId = 0, pipelined = False, max_queue_size = 1, drop_oldest = None,
+                   motion_threshold = None, max_static_frames = None, latest_frame_only = None):
+        """Classify frames from a camera, stream or video file, yields (result, image) tuples.
+
+        Frames are read by a LatestFrameReader. For live sources (cameras and
+        streams) every classification runs on the most recent frame rather than
+        on a stale buffered one, and frames that arrive while the model is busy
+        are skipped. Video files, sources that report a frame count, are read
+        frame by frame instead, so every frame is classified. ``latest_frame_only``
+        overrides this choice. The time from frame capture to classification
+        result is available from ``classifier_stats()``. The generator ends when
+        the capture stops delivering frames (e.g. at the end of a video file).
+
+        With ``pipelined=True`` capture, preprocessing and inference run on
+        separate threads joined by bounded queues (``max_queue_size``), so the
+        frame rate approaches that of the slowest stage instead of the sum of all
+        stages. With ``drop_oldest`` the oldest frame in a full queue is
+        discarded, which keeps latency bounded when inference is slower than the
+        camera. It defaults to the value of ``latest_frame_only``, so frames of
+        video files are not dropped. Per-stage timings and queue depths are
+        available from ``pipeline_stats()`` while the classifier runs.
+
+        With ``motion_threshold`` set, frames go through a MotionGate first. Static
+        frames are not classified (nor preprocessed, unless pipelined); they yield
+        a copy of the last result with ``result['cached'] = True``, together with
+        the image it was classified on. ``max_static_frames`` forces a
+        classification after that many cached results in a row. The gate's hit
+        rate and the inference time it saved are in ``classifier_stats()``.
+        """
         if sys.platform == "darwin":
             print('Make sure to grant the this script access to your webcam.')
             print('If your webcam is not responding, try running "tccutil reset Camera" to reset the camera access privileges.')
 
         self.videoCapture = cv2.VideoCapture(videoDeviceId)
-        while not self.closed:
-            success, img = self.videoCapture.read()
-            if success:
+        self._glass_to_result = StageStats('glass_to_result')
+        self._pipeline = None
+        gate = self._motion_gate = MotionGate(motion_threshold, max_static_frames) if motion_threshold is not None else None
+        with LatestFrameReader(self.videoCapture, latest_only=latest_frame_only) as reader:
+            self._frame_reader = reader
+            if pipelined:
+                if drop_oldest is None:
+                    drop_oldest = reader.latest_only
+                yield from self._pipelined_classifier(reader, max_queue_size, drop_oldest, gate)
+                return
+
+            last = None
+            while not self.closed:
+                success, img, timestamp = reader.read()
+                if not success:
+                    break
+                if self._is_static(gate, img):
+                    yield self._cached_result(last)
+                    continue
                 img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-                features, cropped = self.get_features_from_image(img)
-
-                res = self.classify(features)
+                res, cropped = self.classify_image(img)
+                self._glass_to_result.record(int((time.time() - timestamp) * 1e9))
+                # the extractor reuses its buffer, callers may hold on to (or draw on) the frame
+                cropped = cropped.copy()
+                if gate is not None:
+                    last = (res, cropped.copy())
                 yield res, cropped
 
+    def _is_static(self, gate, img):
+        if gate is None:
+            return False
+        with self._metrics.timer('motion_gate'):
+            return gate.is_static(img)
+
+    def _cached_result(self, last):
+        res, img = last
+        res = dict(res)
+        res['cached'] = True
+        return res, img.copy()
+
+    def _pipelined_classifier(self, reader, max_queue_size, drop_oldest, gate):
+        # the preprocessing thread gets its own extractor, so classify_image can still be used elsewhere
+        mode = self.get_feature_extractor().mode
+        extractor = ImageFeatureExtractor(mode, self.dim[0], self.dim[1], self.isGrayscale)
+
+        def capture():
+            while not self.closed:
+                success, img, timestamp = reader.read()
+                if not success:
+                    break
+                yield img, timestamp
+
+        def preprocess(item):
+            img, timestamp = item
+            with self._metrics.timer('image_preprocess'):
+                img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+                features, resized = self._extract(extractor, img)
+            # the next frame is extracted while this one waits for inference
+            return features.copy(), resized.copy(), timestamp
+
+        last = None
+
+        def infer(item):
+            # gate here rather than before preprocessing: a frame that passed the gate
+            # could be dropped from a full queue, and later frames would be compared with it
+            nonlocal last
+            features, resized, timestamp = item
+            if self._is_static(gate, resized):
+                return self._cached_result(last), None
+            res = self.classify(features)
+            if gate is not None:
+                last = (res, resized.copy())
+            return (res, resized), timestamp
+
+        self._pipeline = Pipeline(capture(), [('preprocess', preprocess), ('inference', infer)],
+                                  max_queue_size=max_queue_size, drop_oldest=drop_oldest, source_name='capture')
+        for item, timestamp in self._pipeline:
+            if timestamp is not None:
+                self._glass_to_result.record(int((time.time() - timestamp) * 1e9))
+            yield item
+            if self.closed:
+                break
+
+    def classifier_stats(self):
+        """Capture-to-result latency, camera and motion gate statistics of the running classifier (or None)."""
+        if self._glass_to_result is None:
+            return None
+        return {
+            'glass_to_result': self._glass_to_result.summary(),
+            'camera': self._frame_reader.stats() if self._frame_reader is not None else None,
+            'pipeline': self.pipeline_stats(),
+            'motion_gate': self._motion_gate_stats(),
+        }
+
+    def _motion_gate_stats(self):
+        if self._motion_gate is None:
+            return None
+        stats = self._motion_gate.stats()
+        # every static frame skipped an average classify call (and preprocessing, unless pipelined),
+        # but all frames paid for the gate
+        summary = self._metrics.summary()
+        skipped = ('roundtrip',) if self._pipeline is not None else ('image_preprocess', 'roundtrip')
+        per_frame = sum(summary[name]['avg_ms'] for name in skipped if name in summary)
+        gate_ms = summary['motion_gate']['avg_ms'] if 'motion_gate' in summary else 0.0
+        stats['saved_ms'] = stats['static'] * per_frame - stats['checked'] * gate_ms
+        return stats
+
+    def _sample_preparer(self):
+        # classify_many samples are RGB images or paths to image files
+        mode = self.get_feature_extractor().mode
+        local = threading.local()
+
+        def prepare(img):
+            if isinstance(img, str):
+                path = img
+                img = cv2.imread(path)
+                if img is None:
+                    raise Exception('Failed to load image ' + path)
+                img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+            extractor = getattr(local, 'extractor', None)
+            if extractor is None:
+                extractor = local.extractor = ImageFeatureExtractor(mode, self.dim[0], self.dim[1], self.isGrayscale)
+            with self._metrics.timer('image_preprocess'):
+                features, _ = self._extract(extractor, img)
+            return features.copy()
+
+        return prepare
+
+    def pipeline_stats(self):
+        """Stage timings, queue depths, drops and fps of the pipelined classifier (or None)."""
+        if self._pipeline is None:
+            return None
+        return self._pipeline.stats()
+
+    # This expects images in RGB format (not BGR)
+    def classify_image(self, img):
+        """Extract features from an image with the studio settings of the model and classify it.
+
+        Features are written straight into the runner's shared memory input when
+        it is available, without going through a Python list. Runners with uint8
+        or int8 input get the resized pixels instead of packed features.
+
+        Returns:
+            tuple: The classification response and the resized image. The image
+            buffer is reused for the next call, copy it if you need to keep it.
+        """
+        extractor = self.get_feature_extractor()
+        out = self.input_buffer()
+        if out is not None and out.size != self._input_size(extractor):
+            out = None
+        with self._metrics.timer('image_preprocess'):
+            features, resized = self._extract(extractor, img, out=out)
+        return self.classify(features), resized
+
+    def _input_size(self, extractor):
+        if self.input_dtype() in (np.uint8, np.int8):
+            return extractor.pixels_count
+        return extractor.features_count
+
+    def _extract(self, extractor, img, out=None):
+        dtype = self.input_dtype()
+        if dtype in (np.uint8, np.int8):
+            return extractor.extract_pixels(img, out=out, dtype=dtype)
+        return extractor.extract(img, out=out)
+
+    def get_feature_extractor(self):
+        """Returns an ImageFeatureExtractor set up with the studio settings of the model."""
+        if self.resizeMode == '':
+            raise Exception(
+                'Runner has not initialized, please call init() first')
+        if self.resizeMode == 'not-reported':
+            self.resizeMode = 'squash'
+
+        extractor = self._extractor
+        if (extractor is None or extractor.mode != self.resizeMode or
+                (extractor.output_width, extractor.output_height) != self.dim or
+                extractor.is_grayscale != self.isGrayscale):
+            extractor = self._extractor = ImageFeatureExtractor(self.resizeMode, self.dim[0], self.dim[1], self.isGrayscale)
+        return extractor
+
     # This expects images in RGB format (not BGR), DEPRECATED, use get_features_from_image_auto_studio_settings
     def get_features_from_image(self, img, crop_direction_x='center', crop_direction_y='center'):
-        features = []
-
         EI_CLASSIFIER_INPUT_WIDTH = self.dim[0]
         EI_CLASSIFIER_INPUT_HEIGHT = self.dim[1]
 
@@ -122,18 +338,10 @@ class ImageImpulseRunner(ImpulseRunner):
 
         if self.isGrayscale:
             cropped = cv2.cvtColor(cropped, cv2.COLOR_BGR2GRAY)
-            pixels = np.array(cropped).flatten().tolist()
-
-            for p in pixels:
-                features.append((p << 16) + (p << 8) + p)
+            features = (cropped.astype(np.uint32) * 0x010101).flatten().tolist()
         else:
-            pixels = np.array(cropped).flatten().tolist()
-
-            for ix in range(0, len(pixels), 3):
-                r = pixels[ix + 0]
-                g = pixels[ix + 1]
-                b = pixels[ix + 2]
-                features.append((r << 16) + (g << 8) + b)
+            pixels = cropped.astype(np.uint32)
+            features = ((pixels[..., 0] << 16) | (pixels[..., 1] << 8) | pixels[..., 2]).flatten().tolist()
 
         return features, cropped
 
@@ -146,6 +354,193 @@ class ImageImpulseRunner(ImpulseRunner):
         return get_features_from_image_with_studio_mode(img, self.resizeMode, self.dim[0], self.dim[1], self.isGrayscale)
 
 
+class LatestFrameReader:
+    """Reads a cv2.VideoCapture on a background thread and only keeps the newest frame.
+
+    ``VideoCapture.read()`` returns the oldest frame in the driver's buffer, so
+    when processing a frame takes longer than the frame interval, results fall
+    further and further behind the camera. This reader grabs frames as soon as
+    they arrive and hands out the most recent one, together with the time it
+    was grabbed. Frames that were never read are counted as skipped.
+
+    A video file is decoded as fast as possible, so keeping only the newest
+    frame would skip most of it. With ``latest_only=False`` the reader grabs the
+    next frame only after the previous one was read, and no frame is skipped.
+    By default that is done for sources that report a frame count (files).
+
+    Args:
+        capture: A cv2.VideoCapture, or anything cv2.VideoCapture accepts (device id, file, URL).
+        on_frame: Optional function called (without arguments) on the capture thread
+            after every new frame, and when the capture fails.
+        latest_only (bool): Keep only the newest frame, None to decide by the frame count.
+    """
+
+    def __init__(self, capture, on_frame=None, latest_only=None):
+        self._capture = capture if isinstance(capture, cv2.VideoCapture) else cv2.VideoCapture(capture)
+        if latest_only is None:
+            # cameras and streams report 0 or -1 frames
+            latest_only = not self._capture.get(cv2.CAP_PROP_FRAME_COUNT) > 0
+        self.latest_only = latest_only
+        self._on_frame = on_frame
+        self._cond = threading.Condition()
+        self._frame = None
+        self._timestamp = 0.0
+        self._seq = 0
+        self._read_seq = 0
+        self._failed = False
+        self._stopped = True
+        self._thread = None
+        self.grabbed_frames = 0
+        self.skipped_frames = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def read(self, timeout=None):
+        """Returns ``(success, frame, timestamp)`` for the newest frame that was not read yet.
+
+        Blocks until a new frame arrives. ``frame`` is in BGR, like
+        ``VideoCapture.read()``, and ``timestamp`` is the ``time.time()`` at which
+        it was grabbed. Returns ``(False, None, 0.0)`` when the capture fails,
+        the reader is stopped or the timeout expires.
+        """
+        with self._cond:
+            ok = self._cond.wait_for(lambda: self._seq != self._read_seq or self._failed or self._stopped, timeout)
+            if not ok or self._seq == self._read_seq:
+                return False, None, 0.0
+            self.skipped_frames = self.skipped_frames + self._seq - self._read_seq - 1
+            self._read_seq = self._seq
+            if not self.latest_only:
+                # the capture thread waits for this frame to be read before grabbing the next
+                self._cond.notify_all()
+            return True, self._frame, self._timestamp
+
+    @property
+    def has_frame(self):
+        """Whether ``read()`` would return a new frame right away."""
+        return self._seq != self._read_seq
+
+    @property
+    def failed(self):
+        return self._failed
+
+    def stats(self):
+        return {
+            'grabbed': self.grabbed_frames,
+            'skipped': self.skipped_frames,
+        }
+
+    def _run(self):
+        while not self._stopped:
+            if not self.latest_only:
+                with self._cond:
+                    self._cond.wait_for(lambda: self._seq == self._read_seq or self._stopped)
+                if self._stopped:
+                    return
+            # grab() only fetches the frame, decoding it is left to retrieve()
+            if not self._capture.grab():
+                with self._cond:
+                    self._failed = True
+                    self._cond.notify_all()
+                if self._on_frame is not None:
+                    self._on_frame()
+                return
+            timestamp = time.time()
+            success, frame = self._capture.retrieve()
+            with self._cond:
+                self.grabbed_frames = self.grabbed_frames + 1
+                if success:
+                    self._frame = frame
+                    self._timestamp = timestamp
+                    self._seq = self._seq + 1
+                    self._cond.notify_all()
+            if success and self._on_frame is not None:
+                self._on_frame()
+
+
+class MotionGate:
+    """Detects static frames, which barely differ from the last frame that was classified.
+
+    Frames are shrunk to a small grayscale thumbnail and compared with the
+    thumbnail of the last frame that passed the gate. A frame is static when the
+    mean absolute difference, as a fraction of full scale, is below
+    ``threshold``. The thumbnail averages 16 pixels sampled from each cell, which
+    smooths out sensor noise, so checking even a 1080p frame takes a fraction
+    of a millisecond.
+
+    Args:
+        threshold (float): Mean absolute difference (0..1) below which a frame is static, e.g. 0.02.
+        max_static_frames (int): Let a frame through after this many static frames in a row,
+            so slow changes (e.g. lighting) are picked up eventually. None to never force one.
+        size (tuple): Width and height of the thumbnail.
+    """
+
+    def __init__(self, threshold, max_static_frames=None, size=(32, 32)):
+        self.threshold = threshold
+        self.max_static_frames = max_static_frames
+        self.size = size
+        self._reference = None
+        self._static_run = 0
+        self.checked_frames = 0
+        self.static_frames = 0
+        self.last_difference = 0.0
+
+    def is_static(self, img):
+        """Whether ``img`` (BGR, RGB or grayscale) is static. Frames that are not static
+        become the reference for the next ones."""
+        # area averaging over the full frame is slow, sample a 4x larger grid first
+        w, h = self.size
+        thumb = cv2.resize(img, (w * 4, h * 4), interpolation=cv2.INTER_NEAREST)
+        thumb = cv2.resize(thumb, self.size, interpolation=cv2.INTER_AREA)
+        if thumb.ndim == 3:
+            thumb = cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY)
+        self.checked_frames = self.checked_frames + 1
+
+        forced = self.max_static_frames is not None and self._static_run >= self.max_static_frames
+        if self._reference is not None and not forced:
+            self.last_difference = cv2.norm(thumb, self._reference, cv2.NORM_L1) / (thumb.size * 255.0)
+            if self.last_difference < self.threshold:
+                self._static_run = self._static_run + 1
+                self.static_frames = self.static_frames + 1
+                return True
+
+        self._reference = thumb
+        self._static_run = 0
+        return False
+
+    def reset(self):
+        """Forget the reference frame, so the next frame is not static."""
+        self._reference = None
+        self._static_run = 0
+
+    def stats(self):
+        return {
+            'checked': self.checked_frames,
+            'static': self.static_frames,
+            'hit_rate': self.static_frames / self.checked_frames if self.checked_frames > 0 else 0.0,
+            'last_difference': self.last_difference,
+        }
+
+
 def resize_image(image, size):
     """Resize an image to the given size using a common interpolation method.
 
@@ -158,37 +553,118 @@ def resize_image(image, size):
     """
     return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
 
-def resize_with_letterbox(image, target_width, target_height):
+class ResizePlan:
+    """Precomputed crop / resize geometry for one source shape, studio mode and target size.
+
+    Every mode is described the same way: the region ``crop`` (x, y, width, height)
+    of the source image is resized into the region ``rect`` (x, y, width, height)
+    of the target image. Anything outside ``rect`` is letterbox padding.
+
+    Get plans through get_resize_plan(), which caches them.
+    """
+
+    def __init__(self, source_shape, mode, target_width, target_height):
+        in_frame_rows, in_frame_cols = source_shape
+        crop = (0, 0, in_frame_cols, in_frame_rows)
+        rect = (0, 0, target_width, target_height)
+
+        if mode == 'fit-shortest':
+            aspect_ratio = target_width / target_height
+            if in_frame_cols / in_frame_rows > aspect_ratio:
+                # Image is wider than target aspect ratio
+                new_width = int(in_frame_rows * aspect_ratio)
+                offset = (in_frame_cols - new_width) // 2
+                crop = (offset, 0, new_width, in_frame_rows)
+            else:
+                # Image is taller than target aspect ratio
+                new_height = int(in_frame_cols / aspect_ratio)
+                offset = (in_frame_rows - new_height) // 2
+                crop = (0, offset, in_frame_cols, new_height)
+        elif mode == 'fit-longest':
+            # Calculate scale factors to preserve aspect ratio
+            scale = min(target_width / in_frame_cols, target_height / in_frame_rows)
+            new_width = int(in_frame_cols * scale)
+            new_height = int(in_frame_rows * scale)
+            top_pad = (target_height - new_height) // 2
+            left_pad = (target_width - new_width) // 2
+            rect = (left_pad, top_pad, new_width, new_height)
+        elif mode != 'squash':
+            raise ValueError(f"Unsupported mode: {mode}")
+
+        self.source_shape = (in_frame_rows, in_frame_cols)
+        self.mode = mode
+        self.target_size = (target_width, target_height)
+        self.crop = crop
+        self.rect = rect
+        self.scale_x = crop[2] / rect[2]
+        self.scale_y = crop[3] / rect[3]
+        self.crop_slices = (slice(crop[1], crop[1] + crop[3]), slice(crop[0], crop[0] + crop[2]))
+        self.rect_slices = (slice(rect[1], rect[1] + rect[3]), slice(rect[0], rect[0] + rect[2]))
+
+    @property
+    def has_padding(self):
+        return self.rect != (0, 0) + self.target_size
+
+    def resize(self, image, out):
+        """Resize ``image`` into ``out`` (target_height x target_width) in place.
+
+        The padding area of ``out`` is left untouched, zero it once when the
+        canvas is allocated.
+        """
+        cv2.resize(image[self.crop_slices], (self.rect[2], self.rect[3]), dst=out[self.rect_slices],
+                   interpolation=cv2.INTER_AREA)
+        return out
+
+    def to_source(self, x, y):
+        """Map a point in target (model input) coordinates to source image coordinates."""
+        return (self.crop[0] + (x - self.rect[0]) * self.scale_x,
+                self.crop[1] + (y - self.rect[1]) * self.scale_y)
+
+    def bbox_to_source(self, bb):
+        """Map a bounding box returned by the runner back to source image coordinates.
+
+        Args:
+            bb (dict): A bounding box with x, y, width and height in model input coordinates.
+
+        Returns:
+            dict: A copy of the bounding box in source image coordinates, clipped to the image.
+        """
+        x0, y0 = self.to_source(bb['x'], bb['y'])
+        x1, y1 = self.to_source(bb['x'] + bb['width'], bb['y'] + bb['height'])
+        rows, cols = self.source_shape
+        x0, x1 = max(0, min(cols, x0)), max(0, min(cols, x1))
+        y0, y1 = max(0, min(rows, y0)), max(0, min(rows, y1))
+        res = dict(bb)
+        res.update({ 'x': int(round(x0)), 'y': int(round(y0)),
+                     'width': int(round(x1 - x0)), 'height': int(round(y1 - y0)) })
+        return res
+
+
+@functools.lru_cache(maxsize=32)
+def _cached_resize_plan(source_shape, mode, target_width, target_height):
+    return ResizePlan(source_shape, mode, target_width, target_height)
+
+def get_resize_plan(source_shape, mode, target_width, target_height):
+    """Returns the (cached) ResizePlan for a source image shape, studio mode and target size."""
+    return _cached_resize_plan(tuple(source_shape[:2]), mode, target_width, target_height)
+
+
+def resize_with_letterbox(image, target_width, target_height, out=None):
     """Resize an image while maintaining aspect ratio using letterboxing.
 
     Args:
         image: The input image as a NumPy array.
-        target_size: A tuple (width, height) specifying the desired output size.
+        target_width: The desired output width.
+        target_height: The desired output height.
+        out: Optional zero-padded canvas (same channels and dtype as image) to write the result into.
 
     Returns:
-        The resized image as a NumPy array and the letterbox dimensions.
+        The resized, padded image as a NumPy array.
     """
-
-    height, width = image.shape[:2]
-
-    # Calculate scale factors to preserve aspect ratio
-    scale_x = target_width / width
-    scale_y = target_height / height
-    scale = min(scale_x, scale_y)
-
-    # Calculate new dimensions and padding
-    new_width = int(width * scale)
-    new_height = int(height * scale)
-    top_pad = (target_height - new_height) // 2
-    bottom_pad = target_height - new_height - top_pad
-    left_pad = (target_width - new_width) // 2
-    right_pad = target_width - new_width - left_pad
-
-    # Resize image and add padding
-    resized_image = resize_image(image, (new_width, new_height))
-    padded_image = cv2.copyMakeBorder(resized_image, top_pad, bottom_pad, left_pad, right_pad, cv2.BORDER_CONSTANT, value=0)
-
-    return padded_image
+    plan = get_resize_plan(image.shape, 'fit-longest', target_width, target_height)
+    if out is None:
+        out = np.zeros((target_height, target_width) + image.shape[2:], dtype=image.dtype)
+    return plan.resize(image, out)
 
 
 def get_features_from_image_with_studio_mode(img, mode, output_width, output_height, is_grayscale):
@@ -208,31 +684,11 @@ def get_features_from_image_with_studio_mode(img, mode, output_width, output_hei
               or (P << 16) + (P << 8) + P for grayscale images.
             - resized_img (numpy.ndarray): The resized image as a NumPy array.
     """
-    features = []
-
-    in_frame_cols = img.shape[1]
-    in_frame_rows = img.shape[0]
-
-    if mode == 'fit-shortest':
-        aspect_ratio = output_width / output_height
-        if in_frame_cols / in_frame_rows > aspect_ratio:
-            # Image is wider than target aspect ratio
-            new_width = int(in_frame_rows * aspect_ratio)
-            offset = (in_frame_cols - new_width) // 2
-            cropped_img = img[:, offset:offset + new_width]
-        else:
-            # Image is taller than target aspect ratio
-            new_height = int(in_frame_cols / aspect_ratio)
-            offset = (in_frame_rows - new_height) // 2
-            cropped_img = img[offset:offset + new_height, :]
-
-        resized_img = cv2.resize(cropped_img, (output_width, output_height), interpolation=cv2.INTER_AREA)
-    elif mode == 'fit-longest':
-        resized_img = resize_with_letterbox(img, output_width, output_height)
-    elif mode == 'squash':
-        resized_img = resize_image(img, (output_width, output_height))
+    plan = get_resize_plan(img.shape, mode, output_width, output_height)
+    if plan.has_padding:
+        resized_img = plan.resize(img, np.zeros((output_height, output_width) + img.shape[2:], dtype=img.dtype))
     else:
-        raise ValueError(f"Unsupported mode: {mode}")
+        resized_img = cv2.resize(img[plan.crop_slices], (output_width, output_height), interpolation=cv2.INTER_AREA)
 
     if is_grayscale:
         resized_img = cv2.cvtColor(resized_img, cv2.COLOR_BGR2GRAY)
@@ -242,4 +698,129 @@ def get_features_from_image_with_studio_mode(img, mode, output_width, output_hei
         pixels = resized_img.astype(np.uint32)
         features = ((pixels[..., 0] << 16) | (pixels[..., 1] << 8) | pixels[..., 2]).flatten().tolist()
 
-    return features, resized_img
\ No newline at end of file
+    return features, resized_img
+
+class ImageFeatureExtractor:
+    """Studio-compatible image preprocessing that reuses its buffers across frames.
+
+    Produces the same features as get_features_from_image_with_studio_mode, but
+    writes them as float32 into a preallocated array (or into ``out``, e.g. the
+    runner's shared memory input buffer) instead of building a Python list. The
+    crop and resize geometry comes from the shared ResizePlan cache, and the
+    resized image, pixel and feature buffers are allocated once per extractor.
+
+    Args:
+        mode (str): The resizing mode to use. Options are 'fit-shortest', 'fit-longest', and 'squash'.
+        output_width (int): The desired output width of the image.
+        output_height (int): The desired output height of the image.
+        is_grayscale (bool): Whether the output image should be converted to grayscale.
+    """
+
+    def __init__(self, mode, output_width, output_height, is_grayscale):
+        if mode not in ('fit-shortest', 'fit-longest', 'squash'):
+            raise ValueError(f"Unsupported mode: {mode}")
+
+        self.mode = mode
+        self.output_width = output_width
+        self.output_height = output_height
+        self.is_grayscale = is_grayscale
+
+        pixel_count = output_width * output_height
+        # geometry for the last source shape, use plan.bbox_to_source() to map results back
+        self.plan = None
+        self._resized = np.zeros((output_height, output_width, 3), dtype=np.uint8)
+        self._gray = np.empty((output_height, output_width), dtype=np.uint8)
+        self._pixels = np.empty((pixel_count, 3), dtype=np.float32)
+        self._features = np.empty((pixel_count,), dtype=np.float32)
+        self._weights = np.array([1 << 16, 1 << 8, 1], dtype=np.float32)
+
+    @property
+    def features_count(self):
+        return self.output_width * self.output_height
+
+    @property
+    def pixels_count(self):
+        return self.output_width * self.output_height * (1 if self.is_grayscale else 3)
+
+    def extract(self, img, out=None):
+        """Extract features from an RGB image.
+
+        Args:
+            img (numpy.ndarray): The input image (RGB, uint8).
+            out (numpy.ndarray): Optional contiguous float32 array with room for
+                ``features_count`` elements to write the features into.
+
+        Returns:
+            tuple: A tuple containing:
+                - features (numpy.ndarray): float32 features, either ``out`` or a buffer owned by
+                  the extractor that is overwritten by the next call.
+                - resized_img (numpy.ndarray): The resized image, also reused by the next call.
+        """
+        if out is None:
+            out = self._features
+        else:
+            out = out[:self.features_count]
+
+        self._resize(img)
+
+        if self.is_grayscale:
+            cv2.cvtColor(self._resized, cv2.COLOR_BGR2GRAY, dst=self._gray)
+            np.copyto(out, self._gray.reshape(-1))
+            out *= 0x010101
+            return out, self._gray
+
+        # (R << 16) | (G << 8) | B as a float32 dot product; every value is an
+        # integer below 2^24, so this is exact
+        np.copyto(self._pixels, self._resized.reshape(-1, 3))
+        np.dot(self._pixels, self._weights, out=out)
+        return out, self._resized
+
+    def extract_pixels(self, img, out=None, dtype=np.uint8):
+        """Resize an RGB image like ``extract``, but return its raw pixels instead of features.
+
+        For runners that take quantized input (see ``ImpulseRunner.input_dtype()``):
+        the pixels are not packed into features and not expanded to float32.
+
+        Args:
+            img (numpy.ndarray): The input image (RGB, uint8).
+            out (numpy.ndarray): Optional contiguous array of ``dtype`` with room for
+                ``pixels_count`` elements to write the pixels into.
+            dtype: uint8, or int8 for pixel values minus 128.
+
+        Returns:
+            tuple: The pixels (HWC order, flattened; ``out`` or a buffer that is overwritten
+            by the next call) and the resized image.
+        """
+        self._resize(img)
+        resized = self._resized
+        if self.is_grayscale:
+            cv2.cvtColor(self._resized, cv2.COLOR_BGR2GRAY, dst=self._gray)
+            resized = self._gray
+        pixels = resized.reshape(-1)
+
+        if np.dtype(dtype) == np.int8:
+            if out is None:
+                out = np.empty((self.pixels_count,), dtype=np.int8)
+            out = out[:self.pixels_count]
+            # flipping the top bit maps 0..255 onto -128..127
+            np.bitwise_xor(pixels, 0x80, out=out.view(np.uint8))
+            return out, resized
+
+        if out is not None:
+            out = out[:self.pixels_count]
+            np.copyto(out, pixels)
+            return out, resized
+        return pixels, resized
+
+    def _resize(self, img):
+        plan = self.plan
+        if plan is None or img.shape[:2] != plan.source_shape:
+            plan = self._set_plan(get_resize_plan(img.shape, self.mode, self.output_width, self.output_height))
+        plan.resize(img, self._resized)
+
+    def _set_plan(self, plan):
+        if plan.has_padding:
+            # the padding stays black, only the image area is written per frame
+            self._resized[:] = 0
+        self.plan = plan
+        return plan
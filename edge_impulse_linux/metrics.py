@@ -0,0 +1,148 @@
+import collections
+import threading
+import time
+import numpy as np
+from edge_impulse_linux.pipeline import StageStats
+
+# stages reported by the model itself in the 'timing' object of a classify response
+MODEL_TIMINGS = ('dsp', 'classification', 'anomaly')
+
+class Histogram(StageStats):
+    """StageStats that also keeps the last ``window`` samples for percentiles."""
+
+    def __init__(self, name, window=1024):
+        super(Histogram, self).__init__(name)
+        self._samples = collections.deque(maxlen=window)
+
+    def record(self, elapsed_ns):
+        super(Histogram, self).record(elapsed_ns)
+        self._samples.append(elapsed_ns)
+
+    def percentiles(self, quantiles=(0.5, 0.95, 0.99)):
+        """Percentiles (in nanoseconds) over the rolling window, zeros when there are no samples."""
+        samples = np.array(self._samples, dtype=np.int64)
+        if samples.size == 0:
+            return [0.0] * len(quantiles)
+        return np.quantile(samples, quantiles).tolist()
+
+    def summary(self):
+        summary = super(Histogram, self).summary()
+        p50, p95, p99 = self.percentiles()
+        summary['p50_ms'] = p50 / 1e6
+        summary['p95_ms'] = p95 / 1e6
+        summary['p99_ms'] = p99 / 1e6
+        return summary
+
+
+class Metrics:
+    """Named timing histograms, e.g. one per stage of a classify call.
+
+    Every runner has one (``runner.metrics()``), which records:
+
+    * ``serialize``, ``write``, ``read`` and ``parse``: encoding the request,
+      writing it to the socket, waiting for the response and decoding it.
+    * ``roundtrip``: all of the above.
+    * ``model_dsp``, ``model_classification``, ``model_anomaly``: as reported by
+      the model, and ``ipc_overhead``: the roundtrip minus those.
+    * ``shm_copy``: copying features into shared memory.
+    * ``cache_lookup``: hashing the input and looking it up, for runners with ``cache_size``.
+    * ``image_preprocess`` and ``motion_gate`` (ImageImpulseRunner), ``audio_gate``
+      and ``audio_smoothing`` (AudioImpulseRunner streaming_classifier).
+
+    Timings are recorded in nanoseconds with ``time.perf_counter_ns``.
+    Percentiles are computed over the last ``window`` samples of each stage.
+
+    Args:
+        window (int): Number of samples per stage kept for percentiles.
+    """
+
+    def __init__(self, window=1024):
+        self._window = window
+        self._histograms = collections.OrderedDict()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def record(self, name, elapsed_ns):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            histogram = self.histogram(name)
+        histogram.record(elapsed_ns)
+        for callback in self._callbacks:
+            callback(name, elapsed_ns)
+
+    def timer(self, name):
+        """Context manager that records the time spent in its block under ``name``."""
+        return _Timer(self, name)
+
+    def histogram(self, name):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(name, self._window)
+            return histogram
+
+    def add_callback(self, callback):
+        """Call ``callback(name, elapsed_ns)`` for every recorded timing.
+
+        Callbacks run on the thread that records the timing, inside the classify
+        call, so they should be quick (e.g. hand the value to a metrics client).
+        """
+        self._callbacks = self._callbacks + [callback]
+
+    def remove_callback(self, callback):
+        self._callbacks = [c for c in self._callbacks if c is not callback]
+
+    def reset(self):
+        with self._lock:
+            self._histograms = collections.OrderedDict()
+
+    def summary(self):
+        """Count, last, average, p50, p95 and p99 (in milliseconds) per stage."""
+        return { name: h.summary() for name, h in list(self._histograms.items()) }
+
+    def prometheus(self, prefix='edge_impulse'):
+        """The timings in the Prometheus text exposition format, as one summary metric
+        with a ``stage`` label (quantiles over the rolling window, in seconds)."""
+        name = prefix + '_stage_seconds'
+        lines = [
+            '# HELP ' + name + ' Time spent per stage of a classify call.',
+            '# TYPE ' + name + ' summary',
+        ]
+        for stage, h in list(self._histograms.items()):
+            for q, value in zip(('0.5', '0.95', '0.99'), h.percentiles()):
+                lines.append('%s{stage="%s",quantile="%s"} %.9f' % (name, stage, q, value / 1e9))
+            lines.append('%s_sum{stage="%s"} %.9f' % (name, stage, h.total_ns / 1e9))
+            lines.append('%s_count{stage="%s"} %d' % (name, stage, h.count))
+        return '\n'.join(lines) + '\n'
+
+    def record_model_timing(self, resp, roundtrip_ns):
+        timing = resp.get('timing')
+        if not isinstance(timing, dict):
+            return
+        model_ns = 0
+        for stage in MODEL_TIMINGS:
+            # newer runners also report microseconds
+            if stage + '_us' in timing:
+                elapsed_ns = int(timing[stage + '_us'] * 1000)
+            elif stage in timing:
+                elapsed_ns = int(timing[stage] * 1000000)
+            else:
+                continue
+            model_ns = model_ns + elapsed_ns
+            self.record('model_' + stage, elapsed_ns)
+        self.record('ipc_overhead', max(0, roundtrip_ns - model_ns))
+
+
+class _Timer:
+    __slots__ = ('_metrics', '_name', '_start')
+
+    def __init__(self, metrics, name):
+        self._metrics = metrics
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self._metrics.record(self._name, time.perf_counter_ns() - self._start)
@@ -0,0 +1,201 @@
+import threading
+import time
+import queue
+
+class DropOldestQueue(queue.Queue):
+    """Bounded queue that discards its oldest item instead of blocking when full.
+
+    With ``drop_oldest=False`` it behaves like a regular ``queue.Queue``.
+    """
+
+    def __init__(self, maxsize=1, drop_oldest=True):
+        super(DropOldestQueue, self).__init__(maxsize)
+        self.drop_oldest = drop_oldest
+        self.dropped = 0
+
+    def put(self, item, block=True, timeout=None):
+        if not self.drop_oldest or self.maxsize <= 0:
+            return super(DropOldestQueue, self).put(item, block, timeout)
+
+        with self.not_full:
+            if self._qsize() >= self.maxsize:
+                self._get()
+                self.unfinished_tasks = self.unfinished_tasks - 1
+                self.dropped = self.dropped + 1
+            self._put(item)
+            self.unfinished_tasks = self.unfinished_tasks + 1
+            self.not_empty.notify()
+
+
+class StageStats:
+    """Rolling timing statistics for one pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.total_ns = 0
+        self.last_ns = 0
+
+    def record(self, elapsed_ns):
+        self.count = self.count + 1
+        self.total_ns = self.total_ns + elapsed_ns
+        self.last_ns = elapsed_ns
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'last_ms': self.last_ns / 1e6,
+            'avg_ms': self.total_ns / self.count / 1e6 if self.count > 0 else 0.0,
+        }
+
+
+class _Item:
+    __slots__ = ('value', 't_source')
+
+    def __init__(self, value, t_source):
+        self.value = value
+        self.t_source = t_source
+
+
+# passed down the queues once the source is exhausted
+_END = object()
+
+
+# passed down the queues like _END when the source or a stage raises, so items
+# that are already in the queues are delivered before the error
+class _Error:
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class Pipeline:
+    """Runs a source and a chain of stages on separate threads, joined by bounded queues.
+
+    Iterating the pipeline yields the output of the last stage. Every queue holds
+    at most ``max_queue_size`` items; with ``drop_oldest`` the oldest item is
+    discarded when a stage falls behind, which keeps latency bounded when a later
+    stage (typically inference) is slower than the source (typically a camera).
+
+    Args:
+        source: An iterable producing the pipeline input, consumed on its own thread.
+        stages (list): ``(name, function)`` tuples, each called with the output of the previous stage.
+        max_queue_size (int): Capacity of every queue between stages.
+        drop_oldest (bool): Drop the oldest item when a queue is full instead of blocking.
+        source_name (str): Name of the source stage in the statistics.
+    """
+
+    def __init__(self, source, stages, max_queue_size=1, drop_oldest=True, source_name='source'):
+        self._source = source
+        self._stages = stages
+        self._stop = threading.Event()
+        self._threads = []
+        self._queues = [DropOldestQueue(max_queue_size, drop_oldest) for _ in range(len(stages) + 1)]
+        self._stats = [StageStats(source_name)] + [StageStats(name) for name, _ in stages]
+        self._latency = StageStats('latency')
+        self._started = None
+
+    def __iter__(self):
+        self.start()
+        try:
+            output = self._queues[-1]
+            while not self._stop.is_set():
+                item = self._get(output)
+                if item is None:
+                    continue
+                if item is _END:
+                    return
+                if isinstance(item, _Error):
+                    raise item.exception
+                self._latency.record(time.perf_counter_ns() - item.t_source)
+                yield item.value
+        finally:
+            self.stop()
+
+    def start(self):
+        if self._started is not None:
+            return
+        self._started = time.perf_counter()
+        self._threads = [threading.Thread(target=self._run_source, daemon=True)]
+        for ix, (_, fn) in enumerate(self._stages):
+            self._threads.append(threading.Thread(target=self._run_stage, args=(ix, fn), daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        self._threads = []
+
+    def stats(self):
+        """Per-stage timings, queue depths, dropped items, end-to-end latency and output rate."""
+        elapsed = time.perf_counter() - self._started if self._started is not None else 0
+        return {
+            'stages': { s.name: s.summary() for s in self._stats },
+            'queues': [{ 'depth': q.qsize(), 'dropped': q.dropped } for q in self._queues],
+            'latency': self._latency.summary(),
+            'fps': self._latency.count / elapsed if elapsed > 0 else 0.0,
+        }
+
+    def _get(self, q):
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            return None
+
+    def _put(self, q, item):
+        # a blocking put must not outlive stop(), or joining the thread would hang
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _put_control(self, q, item):
+        # _END and _Error must never be dropped: the thread that put them is done, nothing
+        # would follow; the queue's only producer has stopped, so nothing can evict them either
+        while not self._stop.is_set():
+            try:
+                queue.Queue.put(q, item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _run_source(self):
+        stats = self._stats[0]
+        out = self._queues[0]
+        try:
+            iterator = iter(self._source)
+            while not self._stop.is_set():
+                t_start = time.perf_counter_ns()
+                try:
+                    value = next(iterator)
+                except StopIteration:
+                    self._put_control(out, _END)
+                    break
+                t_end = time.perf_counter_ns()
+                stats.record(t_end - t_start)
+                self._put(out, _Item(value, t_end))
+        except Exception as e:
+            self._put_control(out, _Error(e))
+
+    def _run_stage(self, ix, fn):
+        stats = self._stats[ix + 1]
+        inp = self._queues[ix]
+        out = self._queues[ix + 1]
+        try:
+            while not self._stop.is_set():
+                item = self._get(inp)
+                if item is None:
+                    continue
+                if item is _END or isinstance(item, _Error):
+                    self._put_control(out, item)
+                    return
+                t_start = time.perf_counter_ns()
+                item.value = fn(item.value)
+                stats.record(time.perf_counter_ns() - t_start)
+                self._put(out, item)
+        except Exception as e:
+            self._put_control(out, _Error(e))
@@ -0,0 +1,211 @@
+import collections
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from edge_impulse_linux.runner import ImpulseRunner
+
+class _Worker:
+    def __init__(self, index):
+        self.index = index
+        self.runner = None
+        self.lock = threading.Lock()
+        self.in_flight = 0
+
+class RunnerPool:
+    """Runs several copies of the same model file and spreads requests over them.
+
+    Every worker is a separate runner process with its own socket and shared
+    memory segments. Requests go to the worker with the fewest requests in
+    flight. Workers are created with ``auto_restart``, so if a worker process
+    dies it is restarted (and any thresholds set through the pool are applied
+    again) before the request is retried once.
+
+    Args:
+        model_path (str): Path to the .eim model file.
+        workers (int): Number of runner processes, defaults to the number of CPU cores.
+        timeout (int): IPC timeout passed to every runner.
+        allow_shm (bool): Whether runners may use shared memory.
+        health_check_interval (float): If set, check the workers in a background
+            thread every this many seconds.
+        runner_class: ImpulseRunner (sub)class used for the workers.
+        broker (str): Lease the workers from the RunnerBroker listening on this socket
+            instead of starting them.
+        freeform_output (str): How workers return freeform outputs from shared memory,
+            see ImpulseRunner.
+        cache_size (int): Size of the result cache of every worker, each worker caches
+            the results of the requests it classified.
+    """
+
+    def __init__(self, model_path: str, workers: int = None, timeout: int = 30, allow_shm = True,
+                 health_check_interval: float = None, runner_class = ImpulseRunner, broker: str = None,
+                 freeform_output = 'list', cache_size: int = 0):
+        self._model_path = model_path
+        self._timeout = timeout
+        self._allow_shm = allow_shm
+        self._runner_class = runner_class
+        self._broker = broker
+        self._freeform_output = freeform_output
+        self._cache_size = cache_size
+        self._workers = [_Worker(ix) for ix in range(workers or os.cpu_count() or 1)]
+        self._lock = threading.Lock()
+        self._debug = False
+        self._thresholds = collections.OrderedDict()
+        self._health_check_interval = health_check_interval
+        self._health_thread = None
+        self._stopped = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def __len__(self):
+        return len(self._workers)
+
+    def init(self, debug=False):
+        self._debug = debug
+        self._stopped.clear()
+
+        # start all runners in parallel, model load time dominates startup
+        with ThreadPoolExecutor(max_workers=len(self._workers)) as executor:
+            hellos = list(executor.map(self._start_worker, self._workers))
+
+        if self._health_check_interval:
+            self._health_thread = threading.Thread(target=self._health_loop, daemon=True)
+            self._health_thread.start()
+
+        return hellos[0]
+
+    def stop(self):
+        self._stopped.set()
+        if self._health_thread is not None:
+            self._health_thread.join()
+            self._health_thread = None
+
+        for worker in self._workers:
+            with worker.lock:
+                if worker.runner is not None:
+                    # keep the runner around, its restart count stays in health_check()
+                    worker.runner.stop()
+
+    def classify(self, data):
+        worker = self._acquire()
+        try:
+            with worker.lock:
+                try:
+                    return worker.runner.classify(data)
+                except Exception:
+                    # a crashed runner restarts itself; only a worker whose earlier restart
+                    # failed (and is not initialized anymore) is started again here
+                    if worker.runner._client is not None:
+                        raise
+                    self._restart_worker(worker)
+                    return worker.runner.classify(data)
+        finally:
+            with self._lock:
+                worker.in_flight = worker.in_flight - 1
+
+    def classify_many(self, samples, ordered=True):
+        """Classify an iterable of feature arrays using all workers.
+
+        Results are yielded in input order, or in completion order when
+        ``ordered`` is False (as ``(index, result)`` tuples).
+        """
+        with ThreadPoolExecutor(max_workers=len(self._workers)) as executor:
+            yield from bounded_map(executor, self.classify, samples, 2 * len(self._workers), ordered)
+
+    def set_threshold(self, obj):
+        if not 'id' in obj:
+            raise Exception('set_threshold requires an object with an "id" field')
+
+        resp = None
+        for worker in self._workers:
+            with worker.lock:
+                resp = worker.runner.set_threshold(dict(obj))
+        # only once the runners accepted it, a rejected threshold would fail every worker restart
+        self._thresholds[obj['id']] = dict(self._thresholds.get(obj['id'], {}), **obj)
+        return resp
+
+    def health_check(self):
+        """Restarts workers whose runner process has exited.
+
+        Returns a list with one dict per worker (``index``, ``alive``, ``restarts``,
+        ``in_flight``), describing the state before any restart. Workers are only
+        restarted once ``init()`` started them.
+        """
+        statuses = []
+        for worker in self._workers:
+            alive = self._is_alive(worker)
+            statuses.append({
+                'index': worker.index,
+                'alive': alive,
+                'restarts': worker.runner.restarts() if worker.runner is not None else 0,
+                'in_flight': worker.in_flight,
+            })
+            if not alive and worker.runner is not None and not self._stopped.is_set():
+                with worker.lock:
+                    if not self._is_alive(worker):
+                        self._restart_worker(worker)
+        return statuses
+
+    def _health_loop(self):
+        while not self._stopped.wait(self._health_check_interval):
+            try:
+                self.health_check()
+            except Exception:
+                # the worker that failed to restart is not initialized anymore, so the next
+                # request it gets starts it again and raises to the caller if that fails too
+                pass
+
+    def _acquire(self):
+        with self._lock:
+            worker = min(self._workers, key=lambda w: w.in_flight)
+            worker.in_flight = worker.in_flight + 1
+            return worker
+
+    def _is_alive(self, worker):
+        runner = worker.runner
+        return runner is not None and runner._is_running()
+
+    def _start_worker(self, worker):
+        worker.runner = self._runner_class(self._model_path, timeout=self._timeout, allow_shm=self._allow_shm,
+                                          freeform_output=self._freeform_output, broker=self._broker,
+                                          auto_restart=True, cache_size=self._cache_size)
+        hello = worker.runner.init(self._debug)
+        for threshold in self._thresholds.values():
+            worker.runner.set_threshold(dict(threshold))
+        return hello
+
+    def _restart_worker(self, worker):
+        # restart() applies the thresholds set through the pool again
+        worker.runner.restart()
+
+
+def bounded_map(executor, fn, iterable, max_pending, ordered=True):
+    """Like ``executor.map``, but never submits more than ``max_pending`` items ahead.
+
+    ``executor.map`` consumes the whole iterable up front, which is not an option
+    for large datasets. When ``ordered`` is False, ``(index, result)`` tuples are
+    yielded as soon as they complete.
+    """
+    if ordered:
+        pending = collections.deque()
+        for item in iterable:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    else:
+        pending = {}
+        for ix, item in enumerate(iterable):
+            pending[executor.submit(fn, item)] = ix
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
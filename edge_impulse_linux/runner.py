@@ -6,37 +6,232 @@ import time
 import signal
 import socket
 import json
-from multiprocessing import shared_memory, resource_tracker
+import struct
+import collections
 import numpy as np
+from edge_impulse_linux.pipeline import Pipeline
+from edge_impulse_linux.metrics import Metrics
+from edge_impulse_linux.cache import ResultCache
+
+# element types reported by the runner for its shared memory segments
+SHM_DTYPES = {
+    'float32': np.float32,
+    'int8': np.int8,
+    'uint8': np.uint8,
+    'int16': np.int16,
+    'int32': np.int32,
+}
+
+FREEFORM_OUTPUT_MODES = ('list', 'view', 'copy')
+
+# seconds to wait for a model to start accepting connections
+STARTUP_TIMEOUT = 30
+
+# binary requests: magic, little-endian uint32 header length, JSON header, raw payload.
+# The runner lists the payload types it accepts in hello, its native input type first;
+# uint8 / int8 payloads are the raw HWC pixels of the resized image (int8 = uint8 - 128)
+BINARY_MAGIC = b'EIB1'
+BINARY_PROTOCOL_VERSION = 1
+
+def shm_dtype(type_name):
+    # older runners did not always report a type, their buffers are float32
+    return np.dtype(SHM_DTYPES.get(type_name, np.float32))
+
+def _terminate_process(process, grace=0.5):
+    # ask nicely first, then escalate; waiting also reaps the child so it does not linger as a zombie
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        if process.poll() is not None:
+            return
+        process.send_signal(sig)
+        try:
+            process.wait(timeout=grace)
+            return
+        except subprocess.TimeoutExpired:
+            pass
+    process.kill()
+    process.wait()
+
+def _check_model_file(model_path):
+    if not os.path.exists(model_path):
+        raise Exception("Model file does not exist: " + model_path)
+
+    if not os.access(model_path, os.X_OK):
+        raise Exception('Model file "' + model_path + '" is not executable')
+
+def _encode_msg(msg, payload=None):
+    header = json.dumps(msg).encode("utf-8")
+    if payload is None:
+        return header
+    return BINARY_MAGIC + struct.pack('<I', len(header)) + header + payload
+
+def _has_shm_freeform(resp):
+    return 'result' in resp and resp['result'].get('freeform') == 'shm'
+
+def _check_resp(resp):
+    if not resp["success"]:
+        raise Exception(resp["error"])
+
+    del resp["id"]
+    del resp["success"]
+    return resp
+
+
+class MessageReader:
+    """Reads \\x00-terminated JSON messages from a runner socket.
+
+    Data is received straight into a preallocated buffer with ``recv_into``, the
+    terminator is located with a single ``find`` over the newly received bytes,
+    and every complete frame is parsed with one ``json.loads`` call. Bytes that
+    follow a terminator (e.g. when several frames arrive in one read) are kept
+    for the next call.
+    """
+
+    def __init__(self, sock, buffer_size=65536):
+        self._sock = sock
+        self._buf = bytearray(buffer_size)
+        self._start = 0     # first byte of the current (unconsumed) frame
+        self._end = 0       # end of the received data
+        self._scanned = 0   # everything before this offset has no terminator
+
+    def read_frame(self):
+        while True:
+            ix = self._buf.find(b"\x00", self._scanned, self._end)
+            if ix != -1:
+                frame = self._buf[self._start:ix]
+                self._start = self._scanned = ix + 1
+                if self._start == self._end:
+                    self._start = self._end = self._scanned = 0
+                return frame
+
+            self._scanned = self._end
+            if self._end == len(self._buf):
+                self._make_room()
+
+            with memoryview(self._buf) as view:
+                n = self._sock.recv_into(view[self._end:])
+            if n == 0:
+                raise ConnectionError("Connection to runner was closed")
+            self._end += n
+
+    def read_message(self):
+        return MessageReader.parse(self.read_frame())
+
+    @staticmethod
+    def parse(frame):
+        try:
+            return json.loads(frame)
+        except ValueError:
+            raise Exception("No data or corrupted data received")
+
+    def _make_room(self):
+        pending = self._end - self._start
+        if self._start > 0:
+            # move the partial frame to the front of the buffer
+            self._buf[:pending] = self._buf[self._start:self._end]
+        else:
+            # the partial frame fills the whole buffer, double it
+            self._buf.extend(bytes(len(self._buf)))
+        self._start = 0
+        self._end = pending
+        self._scanned = pending
 
-def now():
-    return round(time.time() * 1000)
 
 class ImpulseRunner:
-    def __init__(self, model_path: str, timeout: int = 30, allow_shm = True):
+    def __init__(self, model_path: str, timeout: int = 30, allow_shm = True, freeform_output = 'list',
+                 broker: str = None, auto_restart = False, cache_size: int = 0):
+        if freeform_output not in FREEFORM_OUTPUT_MODES:
+            raise ValueError('Invalid value for freeform_output, should be one of ' + ', '.join(FREEFORM_OUTPUT_MODES))
+
         self._model_path = model_path
         self._tempdir = None
         self._runner = None
+        self._broker = broker
+        self._lease = None
         self._client = None
+        self._reader = None
         self._ix = 0
         self._debug = False
         self._hello_resp = None
         self._allow_shm = allow_shm
         self._input_shm = None
         self._freeform_output_shm = []
+        self._binary_types = ()
+        self._freeform_output = freeform_output
+        self._thresholds = collections.OrderedDict()
+        self._batch_stats = None
+        self._startup_stats = None
+        self._startup_timeout = STARTUP_TIMEOUT
+        self._auto_restart = auto_restart
+        self._restarts = 0
+        self._metrics = Metrics()
+        self._cache = ResultCache(cache_size) if cache_size > 0 else None
         self._timeout = timeout if not allow_shm else None
 
-    def init(self, debug=False):
-        if not os.path.exists(self._model_path):
-            raise Exception("Model file does not exist: " + self._model_path)
+    def init(self, debug=False, startup_timeout=STARTUP_TIMEOUT):
+        """Start the model and connect to it, returns the model information.
+
+        Fails with an exception if the runner exits during startup, or does not
+        accept connections within ``startup_timeout`` seconds. How long each
+        startup phase took is available from ``startup_stats()``.
+        """
+        self._startup_timeout = startup_timeout
+        try:
+            socket_path = self._start_runner(debug)
+            self._client = self._connect(socket_path, startup_timeout)
+            # timeout the IPC connection in case the EIM hangs
+            self._client.settimeout(self._timeout)
+            self._reader = MessageReader(self._client)
+
+            t_hello = time.perf_counter()
+            self._hello_resp = self.hello()
+            self._map_shm(self._hello_resp)
+            self._negotiate(self._hello_resp)
+            self._startup_stats['hello'] = (time.perf_counter() - t_hello) * 1000
+            self._startup_stats['total'] = sum(self._startup_stats.values())
+        except BaseException:
+            self.stop()
+            raise
+
+        return self._hello_resp
+
+    def restart(self):
+        """Stop the runner and start it again.
+
+        Thresholds set with ``set_threshold`` are applied to the new process and the
+        shared memory is mapped again, so arrays from ``input_buffer()`` or freeform
+        'view' outputs obtained before the restart must not be used anymore.
+        """
+        thresholds = list(self._thresholds.values())
+        self.stop()
+        self._restarts = self._restarts + 1
+        hello = self.init(self._debug, self._startup_timeout)
+        for threshold in thresholds:
+            self.send_msg({ 'set_threshold': dict(threshold) })
+        return hello
+
+    def restarts(self):
+        """Number of times the runner was restarted, by ``restart()`` or ``auto_restart``."""
+        return self._restarts
+
+    def metrics(self):
+        """The Metrics with per-stage timings of this runner, see edge_impulse_linux.metrics."""
+        return self._metrics
+
+    def startup_stats(self):
+        """Milliseconds spent spawning the process, waiting for its socket, and on hello (incl. shm mapping)."""
+        return self._startup_stats
 
-        if not os.access(self._model_path, os.X_OK):
-            raise Exception('Model file "' + self._model_path + '" is not executable')
+    def _start_runner(self, debug):
+        if self._broker is not None:
+            return self._lease_runner(debug)
+
+        _check_model_file(self._model_path)
 
         self._debug = debug
         self._tempdir = tempfile.mkdtemp()
         socket_path = os.path.join(self._tempdir, "runner.sock")
         cmd = [self._model_path, socket_path]
+        t_spawn = time.perf_counter()
         if debug:
             self._runner = subprocess.Popen(cmd)
         else:
@@ -46,52 +241,114 @@ class ImpulseRunner:
                 stderr=subprocess.DEVNULL,
             )
 
-        while not os.path.exists(socket_path) or self._runner.poll() is not None:
-            time.sleep(0.1)
-
-        if self._runner.poll() is not None:
-            raise Exception("Failed to start runner (" + str(self._runner.poll()) + ")")
+        self._startup_stats = { 'spawn': (time.perf_counter() - t_spawn) * 1000 }
 
-        self._client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        # timeout the IPC connection in case the EIM hangs
-        self._client.settimeout(self._timeout)
-        self._client.connect(socket_path)
+        return socket_path
 
-        hello_resp = self._hello_resp = self.hello()
+    def _lease_runner(self, debug):
+        # the runner is started (or already running) in the broker, so debug output shows up there
+        self._debug = debug
+        t_lease = time.perf_counter()
+        self._lease = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # a cold lease includes starting the runner in the broker, so allow at least the startup timeout
+        self._lease.settimeout(max(self._timeout or 0, self._startup_timeout))
+        self._lease.connect(self._broker)
+        msg = { "id": 1, "lease": os.path.abspath(self._model_path) }
+        self._lease.sendall(json.dumps(msg).encode("utf-8") + b"\x00")
+        resp = _check_resp(MessageReader(self._lease, 4096).read_message())
+        self._startup_stats = { 'lease': (time.perf_counter() - t_lease) * 1000 }
+        return resp['socket']
+
+    def _is_running(self):
+        if self._runner is not None:
+            return self._runner.poll() is None
+        # a leased runner is supervised by the broker, not by us; when it crashes
+        # requests fail with a ConnectionError, which _should_restart handles
+        return self._lease is not None
+
+    def _connect(self, socket_path, startup_timeout):
+        # retry with exponential backoff until the runner listens; this returns as soon
+        # as the socket is ready instead of on the next fixed polling interval
+        t_start = time.perf_counter()
+        deadline = t_start + startup_timeout
+        delay = 0.001
+        while True:
+            if self._runner is not None and self._runner.poll() is not None:
+                raise Exception("Failed to start runner (" + str(self._runner.poll()) + ")")
+
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                client.connect(socket_path)
+                self._startup_stats['socket_ready'] = (time.perf_counter() - t_start) * 1000
+                return client
+            except (FileNotFoundError, ConnectionRefusedError):
+                client.close()
+
+            if time.perf_counter() >= deadline:
+                raise Exception("Runner did not accept connections within " + str(startup_timeout) + " seconds")
+            time.sleep(min(delay, max(0, deadline - time.perf_counter())))
+            delay = min(delay * 2, 0.05)
+
+    def _negotiate(self, hello_resp):
+        # runners that understand binary requests say so in their hello response, others ignore the offer
+        binary = hello_resp.get('binary_protocol')
+        if isinstance(binary, dict) and binary.get('version') == BINARY_PROTOCOL_VERSION:
+            self._binary_types = tuple(binary.get('types', []))
+        else:
+            self._binary_types = ()
+
+    def _map_shm(self, hello_resp):
+        if not self._allow_shm:
+            return
+
+        # imported on first use, to keep importing this module cheap
+        from multiprocessing import shared_memory
+
+        if ('features_shm' in hello_resp.keys()):
+            shm_name = hello_resp['features_shm']['name']
+            # python does not want the leading slash
+            shm_name = shm_name.lstrip('/')
+            shm = shared_memory.SharedMemory(name=shm_name)
+            self._input_shm = {
+                'shm': shm,
+                'type': hello_resp['features_shm']['type'],
+                'elements': hello_resp['features_shm']['elements'],
+                'array': np.ndarray((hello_resp['features_shm']['elements'],),
+                                    dtype=shm_dtype(hello_resp['features_shm']['type']), buffer=shm.buf)
+            }
 
-        if self._allow_shm:
-            if ('features_shm' in hello_resp.keys()):
-                shm_name = hello_resp['features_shm']['name']
+        if ('freeform_output_shm' in hello_resp.keys()):
+            for output_shm in hello_resp['freeform_output_shm']:
+                shm_name = output_shm['name']
                 # python does not want the leading slash
                 shm_name = shm_name.lstrip('/')
                 shm = shared_memory.SharedMemory(name=shm_name)
-                self._input_shm = {
+                array = np.ndarray((output_shm['elements'],), dtype=shm_dtype(output_shm['type']), buffer=shm.buf)
+                view = array.view()
+                view.flags.writeable = False
+                self._freeform_output_shm.append({
+                    'index': output_shm['index'],
                     'shm': shm,
-                    'type': hello_resp['features_shm']['type'],
-                    'elements': hello_resp['features_shm']['elements'],
-                    'array': np.ndarray((hello_resp['features_shm']['elements'],), dtype=np.float32, buffer=shm.buf)
-                }
-
-            if ('freeform_output_shm' in hello_resp.keys()):
-                for output_shm in hello_resp['freeform_output_shm']:
-                    shm_name = output_shm['name']
-                    # python does not want the leading slash
-                    shm_name = shm_name.lstrip('/')
-                    shm = shared_memory.SharedMemory(name=shm_name)
-                    self._freeform_output_shm.append({
-                        'index': output_shm['index'],
-                        'shm': shm,
-                        'type': output_shm['type'],
-                        'elements': output_shm['elements'],
-                        'array': np.ndarray((output_shm['elements'],), dtype=np.float32, buffer=shm.buf)
-                    })
-
-        return self._hello_resp
+                    'type': output_shm['type'],
+                    'elements': output_shm['elements'],
+                    'array': array,
+                    'view': view,
+                })
 
     def __del__(self):
-        self.stop()
+        # may run during interpreter shutdown, when the modules stop() needs are already gone
+        try:
+            self.stop()
+        except Exception:
+            pass
 
     def stop(self):
+        process = self._close()
+        if process is not None:
+            _terminate_process(process)
+
+    def _close(self):
+        # releases everything but the runner process, which is returned to be terminated
         if self._tempdir is not None:
             shutil.rmtree(self._tempdir)
             self._tempdir = None
@@ -99,12 +356,23 @@ class ImpulseRunner:
         if self._client is not None:
             self._client.close()
             self._client = None
+            self._reader = None
 
-        if self._runner is not None:
-            os.kill(self._runner.pid, signal.SIGINT)
-            # todo: in Node we send a SIGHUP after 0.5sec if process has not died, can we do this somehow here too?
-            self._runner = None
+        if self._lease is not None:
+            # closing the lease hands the runner back to the broker, it keeps running
+            self._lease.close()
+            self._lease = None
+
+        runner = self._runner
+        self._runner = None
+        self._unmap_shm()
+        return runner
+
+    def _unmap_shm(self):
+        if self._input_shm is None and len(self._freeform_output_shm) == 0:
+            return
 
+        from multiprocessing import resource_tracker
         if self._input_shm is not None:
             self._input_shm['shm'].close()
             resource_tracker.unregister(self._input_shm['shm']._name, "shared_memory")
@@ -116,98 +384,318 @@ class ImpulseRunner:
         self._freeform_output_shm = []
 
     def hello(self):
-        msg = {"hello": 1}
+        msg = {"hello": 1, "binary_protocol": BINARY_PROTOCOL_VERSION}
         return self.send_msg(msg)
 
-    def classify(self, data):
+    def classify(self, data, freeform_output=None, freeform_out=None):
+        """Classify a list or NumPy array of features.
+
+        Args:
+            data: The features, a list or NumPy array.
+            freeform_output (str): How freeform shared memory outputs are returned, overrides
+                the runner default. 'list' returns Python lists, 'view' returns read-only NumPy
+                views on the shared memory (only valid until the next classify call), and
+                'copy' returns NumPy copies.
+            freeform_out (list): NumPy arrays to copy the freeform outputs into (one per
+                output), e.g. buffers that are reused across calls. Takes precedence over
+                freeform_output.
+
+        With ``cache_size`` set on the runner, results for inputs that were classified
+        before are returned from the cache (see ``cache_stats()``).
+        """
+        key, generation = None, None
+        if self._cache is not None:
+            with self._metrics.timer('cache_lookup'):
+                key = ResultCache.key(data)
+                generation = self._cache.generation
+                hit = self._cache.get(key)
+            if hit is not None:
+                return self._classify_resp(hit[0], freeform_output, freeform_out, hit[1])
+
+        try:
+            send_resp = self.send_msg(*self._classify_msg(data))
+        except Exception as e:
+            if not self._should_restart(e):
+                raise
+            if isinstance(data, np.ndarray):
+                # data may be a view on the shared memory that is about to be unmapped
+                data = data.copy()
+            self.restart()
+            send_resp = self.send_msg(*self._classify_msg(data))
+        if key is not None:
+            self._cache_resp(key, generation, send_resp)
+        return self._classify_resp(send_resp, freeform_output, freeform_out)
+
+    def classify_array(self, data):
+        """Classify a NumPy array of features without converting it to a list.
+
+        With shared memory the array is copied (and cast) straight into the
+        runner's input buffer. An array obtained from ``input_buffer()`` is not
+        copied at all. Without shared memory the raw float32 values are sent if
+        the runner supports binary requests, JSON otherwise.
+        """
+        return self.classify(np.asarray(data).reshape(-1))
+
+    def input_buffer(self):
+        """Returns a writable view of the runner's shared memory input (of ``input_dtype()``),
+        or None if the runner does not use shared memory. Write features into this buffer and
+        pass it (or a prefix of it) to ``classify_array`` to classify without any copies.
+        """
+        if self._input_shm is None:
+            return None
+        return self._input_shm['array']
+
+    def input_dtype(self):
+        """The type the runner takes its input in, as reported in hello: the type of its
+        shared memory input, else its native binary request type, else float32. For
+        uint8 and int8 the input is the raw pixels of the resized image; packed image
+        features passed to ``classify`` are unpacked into pixels for such runners."""
+        if self._input_shm is not None:
+            return self._input_shm['array'].dtype
+        if len(self._binary_types) > 0:
+            return shm_dtype(self._binary_types[0])
+        return np.dtype(np.float32)
+
+    def _classify_msg(self, data):
+        """Returns the classify message and, for binary requests, its payload."""
+        data = self._unpack_features(data)
+        payload = None
         if self._input_shm:
-            self._input_shm['array'][:] = data
+            array = self._input_shm['array']
+            if isinstance(data, np.ndarray):
+                # data may already live in the shm buffer (see input_buffer())
+                if data.__array_interface__['data'][0] != array.__array_interface__['data'][0]:
+                    if data.size != array.size:
+                        raise Exception('Expected ' + str(array.size) + ' features, got ' + str(data.size))
+                    with self._metrics.timer('shm_copy'):
+                        np.copyto(array, data.reshape(-1), casting='unsafe')
+            else:
+                with self._metrics.timer('shm_copy'):
+                    array[:] = data
 
             msg = {
                 "classify_shm": {
-                    "elements": len(data),
+                    "elements": int(np.size(data)),
                 }
             }
+        elif self._binary_dtype(data) is not None:
+            # no decimal text to format and parse, just the raw values
+            features = np.ascontiguousarray(data, dtype=self._binary_dtype(data)).reshape(-1)
+            payload = features.data.cast('B')
+            msg = {
+                "classify_binary": {
+                    "type": features.dtype.name,
+                    "elements": features.size,
+                }
+            }
+        elif isinstance(data, np.ndarray):
+            msg = {"classify": data.reshape(-1).tolist()}
         else:
             msg = {"classify": data}
 
         if self._debug:
             msg["debug"] = True
 
-        send_resp = self.send_msg(msg)
+        return msg, payload
+
+    def _unpack_features(self, data):
+        # runners with quantized input take raw pixels; features packed as (R << 16) + (G << 8) + B,
+        # e.g. from get_features_from_image_auto_studio_settings, are unpacked into them
+        dtype = self.input_dtype()
+        if dtype not in (np.uint8, np.int8) or (isinstance(data, np.ndarray) and data.dtype in (np.uint8, np.int8)):
+            return data
+        params = self._hello_resp.get('model_parameters', {}) if self._hello_resp else {}
+        channels = params.get('image_channel_count', 0)
+        if channels not in (1, 3) or len(data) != params.get('image_input_width', 0) * params.get('image_input_height', 0):
+            return data
+
+        packed = np.asarray(data).reshape(-1).astype(np.uint32)
+        if channels == 3:
+            pixels = np.stack([packed >> 16, packed >> 8, packed], axis=-1).reshape(-1)
+        else:
+            pixels = packed
+        pixels = (pixels & 0xff).astype(np.uint8)
+        if dtype == np.int8:
+            # flipping the top bit maps 0..255 onto -128..127
+            pixels = np.bitwise_xor(pixels, 0x80).view(np.int8)
+        return pixels
+
+    def _binary_dtype(self, data):
+        # quantized input (e.g. pixels) is sent as it is, everything else as float32
+        if isinstance(data, np.ndarray) and data.dtype.name in ('uint8', 'int8') and data.dtype.name in self._binary_types:
+            return data.dtype
+        if 'float32' in self._binary_types:
+            return np.dtype('<f4')
+        return None
+
+    def _classify_resp(self, send_resp, freeform_output=None, freeform_out=None, freeform_arrays=None):
+        if _has_shm_freeform(send_resp):
+            mode = freeform_output or self._freeform_output
+            if mode not in FREEFORM_OUTPUT_MODES:
+                raise ValueError('Invalid value for freeform_output, should be one of ' + ', '.join(FREEFORM_OUTPUT_MODES))
+
+            # read-only arrays, either views on the shared memory or copies from the cache
+            if freeform_arrays is None:
+                freeform_arrays = [shm['view'] for shm in self._freeform_output_shm]
 
-        if 'result' in send_resp and 'freeform' in send_resp['result'] and send_resp['result']['freeform'] == 'shm':
             freeform = []
-            for shm in self._freeform_output_shm:
-                freeform.append(shm['array'].tolist())
+            for ix, array in enumerate(freeform_arrays):
+                if freeform_out is not None:
+                    np.copyto(freeform_out[ix], array, casting='unsafe')
+                    freeform.append(freeform_out[ix])
+                elif mode == 'view':
+                    freeform.append(array)
+                elif mode == 'copy':
+                    freeform.append(array.copy())
+                else:
+                    freeform.append(array.tolist())
             send_resp['result']['freeform'] = freeform
 
         return send_resp
 
+    def _cache_resp(self, key, generation, send_resp):
+        freeform = None
+        if _has_shm_freeform(send_resp):
+            # the shared memory is overwritten by the next request, keep a read-only copy
+            freeform = []
+            for shm in self._freeform_output_shm:
+                array = shm['array'].copy()
+                array.flags.writeable = False
+                freeform.append(array)
+        self._cache.put(key, generation, send_resp, freeform)
+
+    def cache_stats(self):
+        """Hits, misses, hit rate, entries, evictions and invalidations of the result cache
+        (or None when the runner was created without ``cache_size``)."""
+        if self._cache is None:
+            return None
+        return self._cache.stats()
+
+    def _invalidate_cache(self):
+        # thresholds change the results, also of requests that are still in flight
+        if self._cache is not None:
+            self._cache.clear()
+
     def set_threshold(self, obj):
+        self._invalidate_cache()
+        try:
+            resp = self.send_msg(self._set_threshold_msg(obj))
+        except Exception as e:
+            if not self._should_restart(e):
+                raise
+            # restart() only applies the thresholds the runner accepted before
+            self.restart()
+            resp = self.send_msg(self._set_threshold_msg(obj))
+        self._record_threshold(obj)
+        return resp
+
+    def _should_restart(self, e):
+        if not self._auto_restart or self._client is None:
+            return False
+        # runner errors arrive as a response; a socket error (a ConnectionError when the runner
+        # closed the connection) or timeout means the runner is gone or hung, also for broker leases
+        if isinstance(e, OSError):
+            return True
+        # anything else was reported by the runner over a working connection (or failed
+        # before sending), so don't wait for an exit, only check whether it already happened
+        return not self._is_running()
+
+    def _set_threshold_msg(self, obj):
         if not 'id' in obj:
             raise Exception('set_threshold requires an object with an "id" field')
-
-        msg = { 'set_threshold': obj }
-        return self.send_msg(msg)
-
-    def send_msg(self, msg):
-        t_send_msg = now()
-
+        return { 'set_threshold': dict(obj) }
+
+    def _record_threshold(self, obj):
+        # remember the merged state of thresholds the runner accepted, so it can be
+        # applied to restarted or other runner processes; a rejected one would fail every replay
+        self._thresholds[obj['id']] = dict(self._thresholds.get(obj['id'], {}), **obj)
+
+    def classify_many(self, samples, workers=1, ordered=True, prefetch=4):
+        """Classify an iterable of samples, e.g. an offline dataset.
+
+        Samples are prepared on a background thread (up to ``prefetch`` ahead) while
+        the runner classifies earlier ones. For ImpulseRunner a sample is a list or
+        array of features; ImageImpulseRunner and AudioImpulseRunner accept images
+        and audio windows.
+
+        With ``workers`` > 1 a RunnerPool with that many extra runner processes is
+        started for the duration of the call, with the thresholds, ``freeform_output``,
+        broker and cache size of this runner. Every worker has its own result cache,
+        which only lives as long as the call; this runner's cache is not used.
+
+        Yields results in input order, or ``(index, result)`` tuples as soon as they
+        complete when ``ordered`` is False. Throughput of the last run is available
+        from ``batch_stats()``.
+        """
+        prepare = self._sample_preparer()
+        stats = self._batch_stats = { 'samples': 0, 'seconds': 0.0, 'throughput': 0.0, 'workers': workers }
+        start = time.perf_counter()
+
+        def record():
+            stats['samples'] = stats['samples'] + 1
+            stats['seconds'] = time.perf_counter() - start
+            stats['throughput'] = stats['samples'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+
+        if workers <= 1:
+            pipeline = Pipeline(samples, [('prepare', prepare)], max_queue_size=prefetch, drop_oldest=False)
+            for ix, features in enumerate(pipeline):
+                res = self.classify(features)
+                record()
+                yield res if ordered else (ix, res)
+            return
+
+        # imported here, pool depends on this module
+        from concurrent.futures import ThreadPoolExecutor
+        from edge_impulse_linux.pool import RunnerPool, bounded_map
+
+        cache_size = self._cache.max_entries if self._cache is not None else 0
+        with RunnerPool(self._model_path, workers=workers, timeout=self._timeout, allow_shm=self._allow_shm,
+                        broker=self._broker, freeform_output=self._freeform_output, cache_size=cache_size) as pool:
+            pool.init(self._debug)
+            for threshold in self._thresholds.values():
+                pool.set_threshold(dict(threshold))
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for item in bounded_map(executor, lambda sample: pool.classify(prepare(sample)),
+                                        samples, workers + prefetch, ordered):
+                    record()
+                    yield item
+
+    def batch_stats(self):
+        """Sample count, elapsed seconds and throughput (samples/s) of the last classify_many call."""
+        return self._batch_stats
+
+    def _sample_preparer(self):
+        # returns a thread-safe function that turns a classify_many sample into features
+        return lambda sample: sample
+
+    def send_msg(self, msg, payload=None):
         if not self._client:
             raise Exception("ImpulseRunner is not initialized (call init())")
 
         self._ix = self._ix + 1
         ix = self._ix
 
+        t_start = time.perf_counter_ns()
         msg["id"] = ix
-        self._client.send(json.dumps(msg).encode("utf-8"))
-
-        t_sent_msg = now()
-
-        data = b""
-        while True:
-            chunk = self._client.recv(1024)
-            # end chunk has \x00 in the end
-            if chunk[-1] == 0:
-                data = data + chunk[:-1]
-                break
-            data = data + chunk
-
-        t_received_msg = now()
-
-        braces_open = 0
-        braces_closed = 0
-        line = ""
-        resp = None
-
-        for c in data.decode("utf-8"):
-            if c == "{":
-                line = line + c
-                braces_open = braces_open + 1
-            elif c == "}":
-                line = line + c
-                braces_closed = braces_closed + 1
-                if braces_closed == braces_open:
-                    resp = json.loads(line)
-            elif braces_open > 0:
-                line = line + c
-
-            if resp is not None:
-                break
-
-        if resp is None:
-            raise Exception("No data or corrupted data received")
+        data = _encode_msg(msg, payload)
+        t_serialized = time.perf_counter_ns()
+        self._client.sendall(data)
+        t_sent = time.perf_counter_ns()
+        frame = self._reader.read_frame()
+        t_received = time.perf_counter_ns()
+        resp = MessageReader.parse(frame)
+        t_parsed = time.perf_counter_ns()
+
+        metrics = self._metrics
+        metrics.record('serialize', t_serialized - t_start)
+        metrics.record('write', t_sent - t_serialized)
+        metrics.record('read', t_received - t_sent)
+        metrics.record('parse', t_parsed - t_received)
+        metrics.record('roundtrip', t_parsed - t_start)
+        metrics.record_model_timing(resp, t_parsed - t_start)
 
         if resp["id"] != ix:
-            raise Exception("Wrong id, expected: " + str(ix) + " but got " + resp["id"])
+            raise Exception("Wrong id, expected: " + str(ix) + " but got " + str(resp["id"]))
 
-        if not resp["success"]:
-            raise Exception(resp["error"])
-
-        del resp["id"]
-        del resp["success"]
-
-        t_parsed_msg = now()
-        # print('sent', t_sent_msg - t_send_msg, 'received', t_received_msg - t_send_msg, 'parsed', t_parsed_msg - t_send_msg)
-        return resp
+        return _check_resp(resp)
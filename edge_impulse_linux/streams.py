@@ -0,0 +1,229 @@
+import itertools
+import queue
+import threading
+import time
+from edge_impulse_linux.image import LatestFrameReader, cv2
+from edge_impulse_linux.metrics import Histogram
+from edge_impulse_linux.pipeline import DropOldestQueue
+
+SCHEDULING_POLICIES = ('round-robin', 'deadline')
+
+class _Stream:
+    def __init__(self, stream_id, reader, max_fps):
+        self.id = stream_id
+        self.reader = reader
+        self.period = 1.0 / max_fps if max_fps else 0.0
+        self.next_due = 0.0
+        self.busy = False
+        self.classified = 0
+        self.latency = Histogram('glass_to_result')
+
+
+class StreamScheduler:
+    """Classifies frames from several cameras or video streams on a shared set of runners.
+
+    Every stream is read by a LatestFrameReader, so a live stream that is waiting
+    for a runner is always classified on its newest frame (video files are
+    classified frame by frame). Each runner is driven by its own thread;
+    whenever a runner is free it picks the next stream that has a new frame and
+    is not over its frame rate cap:
+
+    * ``'round-robin'``: streams take turns in the order they were added.
+    * ``'deadline'``: the stream whose next frame is due first (the least recently
+      served one, for streams without a cap) goes first, so streams with a higher
+      ``max_fps`` get proportionally more inferences.
+
+    Iterating the scheduler yields ``(result, image)`` tuples like
+    ``ImageImpulseRunner.classifier``, with the stream id and capture time added
+    to the result as ``result['stream_id']`` and ``result['timestamp']``. It ends
+    when all streams have ended (e.g. video files).
+
+    Args:
+        runners: An initialized ImageImpulseRunner, or a list of them (e.g. several
+            runners for the same model to use more cores).
+        policy (str): 'round-robin' or 'deadline'.
+        max_queue_size (int): Results buffered for the consumer, runners wait when it is full.
+    """
+
+    def __init__(self, runners, policy='round-robin', max_queue_size=None):
+        if policy not in SCHEDULING_POLICIES:
+            raise ValueError('Invalid value for policy, should be one of ' + ', '.join(SCHEDULING_POLICIES))
+
+        self._runners = runners if isinstance(runners, (list, tuple)) else [runners]
+        self._policy = policy
+        self._streams = []
+        self._next_stream = 0
+        self._cond = threading.Condition()
+        self._results = DropOldestQueue(max_queue_size or 2 * len(self._runners), drop_oldest=False)
+        self._stopped = threading.Event()
+        self._threads = []
+        self._runner_stats = [{ 'classified': 0, 'busy_seconds': 0.0 } for _ in self._runners]
+        self._started = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def add_stream(self, stream_id, source, max_fps=None):
+        """Add a capture source (a cv2.VideoCapture, device id, file or URL), classified at
+        most ``max_fps`` times per second. Streams can be added while the scheduler runs."""
+        with self._cond:
+            if any(s.id == stream_id for s in self._streams):
+                raise Exception('A stream with id ' + str(stream_id) + ' already exists')
+
+        reader = LatestFrameReader(source, on_frame=self._wake)
+        stream = _Stream(stream_id, reader, max_fps)
+        with self._cond:
+            self._streams.append(stream)
+        if self._started is not None:
+            reader.start()
+        return stream_id
+
+    def start(self):
+        if self._started is not None:
+            return
+        self._started = time.perf_counter()
+        self._stopped.clear()
+        for stream in list(self._streams):
+            stream.reader.start()
+        for ix, runner in enumerate(self._runners):
+            thread = threading.Thread(target=self._run_worker, args=(ix, runner), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stopped.set()
+        self._wake()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        self._threads = []
+        for stream in list(self._streams):
+            stream.reader.stop()
+
+    def __iter__(self):
+        self.start()
+        try:
+            while not self._stopped.is_set():
+                try:
+                    item = self._results.get(timeout=0.1)
+                except queue.Empty:
+                    if self._all_ended():
+                        return
+                    continue
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.stop()
+
+    def stats(self):
+        """Total results per second, and per stream the classified frames, rate and
+        capture-to-result latency (p50/p95/p99), and per runner its utilization."""
+        elapsed = time.perf_counter() - self._started if self._started is not None else 0
+        with self._cond:
+            streams = list(self._streams)
+        total = sum(s.classified for s in streams)
+        return {
+            'fps': total / elapsed if elapsed > 0 else 0.0,
+            'streams': { s.id: {
+                'classified': s.classified,
+                'fps': s.classified / elapsed if elapsed > 0 else 0.0,
+                'latency': s.latency.summary(),
+                'camera': s.reader.stats(),
+                'ended': s.reader.failed,
+            } for s in streams },
+            'runners': [{
+                'classified': r['classified'],
+                'utilization': r['busy_seconds'] / elapsed if elapsed > 0 else 0.0,
+            } for r in self._runner_stats],
+        }
+
+    def _wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def _all_ended(self):
+        with self._cond:
+            return len(self._streams) > 0 and all(
+                s.reader.failed and not s.reader.has_frame and not s.busy for s in self._streams)
+
+    def _next_frame(self):
+        """Picks a stream and reads its frame, or returns how long to wait. Called with the lock held."""
+        now = time.monotonic()
+        count = len(self._streams)
+        ready = []
+        wait = None
+        order = range(count)
+        if self._policy == 'round-robin':
+            order = itertools.chain(range(self._next_stream, count), range(0, self._next_stream))
+        for ix in order:
+            stream = self._streams[ix]
+            if stream.busy or not stream.reader.has_frame:
+                continue
+            if stream.next_due > now:
+                # capped, wake up when it is due again
+                delay = stream.next_due - now
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            ready.append((ix, stream))
+            if self._policy == 'round-robin':
+                break
+
+        if len(ready) == 0:
+            return None, wait
+        if self._policy == 'round-robin':
+            ix, stream = ready[0]
+            self._next_stream = (ix + 1) % count
+        else:
+            ix, stream = min(ready, key=lambda item: item[1].next_due)
+
+        success, frame, timestamp = stream.reader.read(0)
+        if not success:
+            return None, 0
+        stream.busy = True
+        stream.next_due = max(stream.next_due + stream.period, now) if stream.period > 0 else now
+        return (stream, frame, timestamp), None
+
+    def _run_worker(self, ix, runner):
+        stats = self._runner_stats[ix]
+        try:
+            while not self._stopped.is_set():
+                with self._cond:
+                    item, wait = self._next_frame()
+                    if item is None:
+                        # new frames and stop() wake us up, the timeout covers caps and ended streams
+                        self._cond.wait(min(wait, 0.1) if wait is not None else 0.1)
+                        continue
+
+                stream, frame, timestamp = item
+                try:
+                    t_start = time.perf_counter()
+                    img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                    res, resized = runner.classify_image(img)
+                    stats['busy_seconds'] = stats['busy_seconds'] + time.perf_counter() - t_start
+                    stats['classified'] = stats['classified'] + 1
+                    stream.classified = stream.classified + 1
+                    stream.latency.record(int((time.time() - timestamp) * 1e9))
+                finally:
+                    with self._cond:
+                        stream.busy = False
+                        self._cond.notify_all()
+
+                res['stream_id'] = stream.id
+                res['timestamp'] = timestamp
+                # the runner reuses its image buffer for the next frame
+                self._put((res, resized.copy()))
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        # a blocking put must not outlive stop(), or joining the worker would hang
+        while not self._stopped.is_set():
+            try:
+                self._results.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
@@ -0,0 +1,23 @@
+import os
+import pytest
+
+STUB_RUNNER = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'benchmarks', 'stub_runner.py')
+STUB_ENV = ('EI_STUB_LATENCY_MS', 'EI_STUB_BUSY', 'EI_STUB_BOXES', 'EI_STUB_FEATURES',
+            'EI_STUB_FREQUENCY', 'EI_STUB_SHM', 'EI_STUB_FREEFORM', 'EI_STUB_BINARY',
+            'EI_STUB_INPUT_TYPE')
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """Returns a function that configures the stub runner and returns its path to use as model file.
+
+    The stub reads its settings from the environment when the runner starts it,
+    e.g. ``stub(features=16, binary=1)`` sets EI_STUB_FEATURES and EI_STUB_BINARY.
+    """
+    def configure(**settings):
+        for key in STUB_ENV:
+            monkeypatch.delenv(key, raising=False)
+        for key, value in settings.items():
+            monkeypatch.setenv('EI_STUB_' + key.upper(), str(value))
+        return STUB_RUNNER
+    return configure
@@ -0,0 +1,22 @@
+import asyncio
+import os
+import signal
+from edge_impulse_linux.async_runner import AsyncImpulseRunner
+
+
+def test_concurrent_failures_restart_once(stub):
+    model_path = stub(features=16, latency_ms=20)
+
+    async def run():
+        async with AsyncImpulseRunner(model_path, auto_restart=True) as runner:
+            await runner.init()
+            await runner.set_threshold({ 'id': 3, 'min_score': 0.7 })
+            os.kill(runner._runner.pid, signal.SIGKILL)
+            results = await asyncio.gather(*[runner.classify([0.0] * 16) for _ in range(4)])
+            hello = await runner.hello()
+            return results, runner.restarts(), hello['model_parameters']['thresholds']
+
+    results, restarts, thresholds = asyncio.run(run())
+    assert all('classification' in res['result'] for res in results)
+    assert restarts == 1
+    assert thresholds == [{ 'id': 3, 'min_score': 0.7, 'type': 'object_detection' }]
@@ -0,0 +1,59 @@
+import wave
+import numpy as np
+import pytest
+from edge_impulse_linux.audio import AudioFileSource, RingBuffer
+
+
+def test_ring_buffer_wraparound():
+    ring = RingBuffer(8)
+    samples = np.arange(1, 100, dtype=np.int16)
+    pos = 0
+    # write and consume sizes that don't divide the capacity, so windows start at every offset
+    for _ in range(20):
+        pos = pos + ring.write(samples[pos:pos + 5])
+        window = ring.peek(len(ring))
+        assert window.flags['C_CONTIGUOUS']
+        assert list(window) == list(samples[pos - len(ring):pos])
+        ring.consume(3)
+
+
+def test_ring_buffer_write_when_full():
+    ring = RingBuffer(4)
+    assert ring.write(np.array([1, 2, 3], dtype=np.int16)) == 3
+    assert ring.write(np.array([4, 5, 6], dtype=np.int16)) == 1
+    assert ring.free() == 0
+    ring.consume(2)
+    assert ring.write(np.array([7, 8, 9], dtype=np.int16)) == 2
+    assert list(ring.peek(4)) == [3, 4, 7, 8]
+    with pytest.raises(Exception):
+        ring.peek(5)
+
+
+def write_wav(path, samples, sample_rate):
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(samples.astype('<i2').tobytes())
+
+
+@pytest.mark.parametrize('source_rate,target_rate', [(44100, 16000), (8000, 16000), (16000, 16000)])
+def test_resampled_is_independent_of_block_size(tmp_path, source_rate, target_rate):
+    t = np.arange(source_rate) / source_rate
+    samples = 8000 * np.sin(2 * np.pi * 440 * t) + 4000 * np.sin(2 * np.pi * 3000 * t)
+    write_wav(tmp_path / 'tone.wav', samples, source_rate)
+    source = AudioFileSource(str(tmp_path / 'tone.wav'))
+
+    whole = np.concatenate(list(source.resampled(target_rate)))
+    for block_size in (1, 97, 1000, 4096):
+        assert np.array_equal(np.concatenate(list(source.resampled(target_rate, block_size=block_size))), whole)
+    assert len(whole) == int(source.frames * target_rate / source_rate)
+
+
+def test_downsampling_removes_frequencies_above_nyquist(tmp_path):
+    # 12 kHz is above the 8 kHz Nyquist frequency of the output and would alias to 4 kHz
+    t = np.arange(48000) / 48000
+    write_wav(tmp_path / 'high.wav', 8000 * np.sin(2 * np.pi * 12000 * t), 48000)
+    out = np.concatenate(list(AudioFileSource(str(tmp_path / 'high.wav')).resampled(16000)))
+    # skip the filter's edge effects at both ends
+    assert np.abs(out[1000:-1000]).max() < 100
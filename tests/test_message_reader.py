@@ -0,0 +1,77 @@
+import json
+import socket
+import pytest
+from edge_impulse_linux.runner import MessageReader
+
+
+class ChunkedSocket:
+    """Hands out the given chunks one recv_into call at a time, like a slow socket."""
+
+    def __init__(self, chunks):
+        self._chunks = list(chunks)
+
+    def recv_into(self, view):
+        if not self._chunks:
+            return 0
+        chunk = self._chunks.pop(0)
+        n = min(len(chunk), len(view))
+        view[:n] = chunk[:n]
+        if n < len(chunk):
+            self._chunks.insert(0, chunk[n:])
+        return n
+
+
+def frame(obj):
+    return json.dumps(obj).encode('utf-8') + b'\x00'
+
+
+def test_frame_split_over_reads():
+    data = frame({ 'id': 1, 'result': { 'classification': { 'a': 0.25, 'b': 0.75 } } })
+    reader = MessageReader(ChunkedSocket([data[i:i + 3] for i in range(0, len(data), 3)]))
+    assert reader.read_message() == { 'id': 1, 'result': { 'classification': { 'a': 0.25, 'b': 0.75 } } }
+
+
+def test_multiple_frames_in_one_read():
+    reader = MessageReader(ChunkedSocket([frame({ 'id': 1 }) + frame({ 'id': 2 }) + frame({ 'id': 3 })[:5],
+                                          frame({ 'id': 3 })[5:]]))
+    assert [reader.read_message()['id'] for _ in range(3)] == [1, 2, 3]
+
+
+def test_frame_larger_than_buffer():
+    big = { 'id': 1, 'result': { 'freeform': [[float(i) for i in range(1000)]] } }
+    reader = MessageReader(ChunkedSocket([frame(big)[:100], frame(big)[100:] + frame({ 'id': 2 })]), buffer_size=16)
+    assert reader.read_message() == big
+    assert reader.read_message() == { 'id': 2 }
+
+
+def test_partial_frame_is_moved_to_front():
+    # the second frame starts near the end of the buffer and has to be moved before it fits
+    first, second = frame({ 'id': 1, 'pad': 'x' * 20 }), frame({ 'id': 2, 'pad': 'y' * 20 })
+    reader = MessageReader(ChunkedSocket([first + second[:10], second[10:]]), buffer_size=len(first) + 10)
+    assert reader.read_message()['id'] == 1
+    assert reader.read_message()['id'] == 2
+
+
+def test_closed_connection():
+    reader = MessageReader(ChunkedSocket([frame({ 'id': 1 }), b'{"id": 2']))
+    assert reader.read_message() == { 'id': 1 }
+    with pytest.raises(ConnectionError):
+        reader.read_message()
+
+
+def test_corrupted_frame():
+    reader = MessageReader(ChunkedSocket([b'{"id": 1\x00']))
+    with pytest.raises(Exception, match='corrupted'):
+        reader.read_message()
+
+
+def test_socketpair():
+    a, b = socket.socketpair()
+    try:
+        b.sendall(frame({ 'id': 1 }) + frame({ 'id': 2 }))
+        reader = MessageReader(a)
+        assert reader.read_message() == { 'id': 1 }
+        assert reader.read_message() == { 'id': 2 }
+    finally:
+        a.close()
+        b.close()
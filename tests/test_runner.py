@@ -0,0 +1,74 @@
+import os
+import signal
+import numpy as np
+import pytest
+from edge_impulse_linux.runner import ImpulseRunner
+
+
+@pytest.fixture
+def runners():
+    started = []
+    def start(model_path, **kwargs):
+        runner = ImpulseRunner(model_path, **kwargs)
+        started.append(runner)
+        runner.init()
+        return runner
+    yield start
+    for runner in started:
+        runner.stop()
+
+
+def thresholds(runner):
+    return runner.hello()['model_parameters']['thresholds']
+
+
+def test_binary_requests_when_runner_supports_them(stub, runners):
+    runner = runners(stub(features=16, binary=1))
+    msg, payload = runner._classify_msg(np.arange(16, dtype=np.float64))
+    assert msg == { 'classify_binary': { 'type': 'float32', 'elements': 16 } }
+    assert np.array_equal(np.frombuffer(payload, dtype='<f4'), np.arange(16))
+    assert 'classification' in runner.classify([0.5] * 16)['result']
+
+
+def test_json_requests_when_runner_ignores_binary_offer(stub, runners):
+    runner = runners(stub(features=16, binary=0))
+    msg, payload = runner._classify_msg(np.arange(16, dtype=np.float32))
+    assert msg == { 'classify': list(range(16)) }
+    assert payload is None
+    assert 'classification' in runner.classify([0.5] * 16)['result']
+
+
+def test_quantized_input_is_sent_as_is(stub, runners):
+    runner = runners(stub(features=4, binary=1, input_type='uint8'))
+    assert runner.input_dtype() == np.uint8
+    msg, _ = runner._classify_msg(np.zeros(12, dtype=np.uint8))
+    assert msg == { 'classify_binary': { 'type': 'uint8', 'elements': 12 } }
+    assert 'classification' in runner.classify(np.zeros(12, dtype=np.uint8))['result']
+
+
+def test_restart_replays_thresholds(stub, runners):
+    runner = runners(stub(features=16), auto_restart=True)
+    runner.set_threshold({ 'id': 3, 'min_score': 0.7 })
+
+    os.kill(runner._runner.pid, signal.SIGKILL)
+    runner._runner.wait()
+    assert 'classification' in runner.classify([0.0] * 16)['result']
+    assert runner.restarts() == 1
+    assert thresholds(runner) == [{ 'id': 3, 'min_score': 0.7, 'type': 'object_detection' }]
+
+
+def test_rejected_threshold_is_not_replayed(stub, runners):
+    runner = runners(stub(features=16), auto_restart=True)
+    with pytest.raises(Exception, match='Unknown threshold id'):
+        runner.set_threshold({ 'id': 99, 'min_score': 0.1 })
+
+    runner.restart()
+    assert runner.restarts() == 1
+    assert thresholds(runner) == [{ 'id': 3, 'min_score': 0.5, 'type': 'object_detection' }]
+
+
+def test_runner_errors_do_not_restart(stub, runners):
+    runner = runners(stub(features=16), auto_restart=True)
+    with pytest.raises(Exception, match='Expected 16 features, got 3'):
+        runner.classify([0.0] * 3)
+    assert runner.restarts() == 0